@@ -1,10 +1,28 @@
+from __future__ import annotations
+import hashlib
+import queue
+from datetime import date, timedelta
+from urllib.parse import quote
 import requests
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from logging import Logger
-from etl.connectors.postgresql import PostgreSqlClient
+from typing import TYPE_CHECKING
+from etl.connectors.http_client import HttpClient
+from etl.connectors.checkpoint_store import CheckpointStore
+from etl.connectors.metrics import get_metrics
+from etl.connectors.record_store import RecordStore
+
+# Only a type here, importing it would load SQLAlchemy and pandas before the nothing-changed probe
+if TYPE_CHECKING:
+    from etl.connectors.postgresql import PostgreSqlClient
+
+# Query strings above ~2k characters are rejected or truncated by some proxies
+MAX_QUERY_LENGTH = 2000
 
 class ExtractBalldontlie:
-    def __init__(self, sql_client: PostgreSqlClient, logger: Logger, api_key: str, api_url: str, team_id: int, season: str, mode: str):
+    def __init__(self, sql_client: PostgreSqlClient, logger: Logger, api_key: str, api_url: str, team_id: int, season: str, mode: str, http_client: HttpClient = None, max_workers: int = 4, stats_chunk_size: int = 25, stats_date_shards: int = 1, checkpoint_store: CheckpointStore = None, start_date: str = None, end_date: str = None, window_days: int = 3, layout: str = "per_team"):
         self.api_key = api_key
         self.team_id = team_id
         self.season = season
@@ -12,90 +30,355 @@ class ExtractBalldontlie:
         self.logger = logger
         self.sql_client = sql_client
         self.mode = mode
+        # Shared across extractors in batch runs so connections are reused
+        self.http_client = http_client or HttpClient()
+        self.max_workers = max_workers
+        self.stats_chunk_size = stats_chunk_size
+        # Splits every player chunk into date ranges of the season, each paged as its own cursor chain
+        self.stats_date_shards = stats_date_shards
+        self.checkpoint_store = checkpoint_store
+        # Last cursor reached per cursor chain, saved to the checkpoint store once the pages are loaded
+        self.cursors = {}
+        self.cursors_lock = threading.Lock()
+        # Window mode only fetches the games of a date range and the box scores of the finished ones.
+        # Without a start date the window starts at the last final game seen, or `window_days` ago.
+        self.start_date = start_date
+        self.end_date = end_date
+        self.window_days = window_days
+        # Where loaded rows are looked up when there is no checkpoint, see LoadBalldontlie
+        self.layout = layout
         
     def extract(self):
         team = self.extract_team()
         self.team_name = team.get('name').lower()
         self.logger.info(f"Extracted team data: {self.team_name}")
         
-        team_players = self.extract_players()
-        self.logger.info(f"Extracted players data on season {self.season}. Size: {len(team_players)}")
+        if self.mode == "window":
+            return (team, *self._extract_window())
         
-        team_games = self.extract_games()
-        self.logger.info(f"Extracted games data on season {self.season}. Size: {len(team_games)}")
-        
-        player_ids = [player.get("id") for player in team_players]
-        players_stats = self.extract_players_stats(player_ids)
-        self.logger.info(f"Extracted players stats data on season {self.season}. Size: {len(players_stats)}")
+        # Games do not depend on the roster, so they are fetched while players and stats are paged
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            games_future = executor.submit(self.extract_games)
+            
+            team_players = self.extract_players()
+            self.logger.info(f"Extracted players data on season {self.season}. Size: {len(team_players)}")
+            
+            player_ids = team_players.ids()
+            players_stats = self.extract_players_stats(player_ids)
+            self.logger.info(f"Extracted players stats data on season {self.season}. Size: {len(players_stats)}")
+            
+            team_games = games_future.result()
+            self.logger.info(f"Extracted games data on season {self.season}. Size: {len(team_games)}")
         
         return team, team_players, team_games, players_stats
 
     def extract_players(self):
-        cursor = 0
-        if self.mode == "increment":
-            cursor = self.sql_client.select_max_id(f"{self.team_name}_{self.season}_players_performance")
-            self.logger.info(f"Extracting players stats cursor: {cursor}")
-            
+        # The whole roster is always fetched: it fits in a page or two and every player's stats chain depends on it
         url = f"{self.base_url}/players/active"
         params = {
             "team_ids[]": self.team_id,
             "per_page": 100 
         }
         
-        collected_data = []
-        self._fetch_pagination_data(url=url, collected_data=collected_data, params=params, next_cursor=cursor)
+        collected_data = RecordStore()
+        with get_metrics().timer("extract", endpoint="players"):
+            self._fetch_pagination_data(url=url, collected_data=collected_data, params=params)
        
         return collected_data
 
     def extract_team(self):
         url = f"{self.base_url}/teams/{self.team_id}"
-        data = self._fetch_data(url)
+        with get_metrics().timer("extract", endpoint="team"):
+            data = self._fetch_data_with_retries(url)
         return data.get("data")
 
     def extract_games(self):
-        cursor = 0
-        if self.mode == "increment":
-            cursor = self.sql_client.select_max_id(f"{self.team_name}_{self.season}_games")
-            self.logger.info(f"Extracting games cursor: {cursor}")
-            
         url = f"{self.base_url}/games"
         params = {
             "team_ids[]": self.team_id,
-            "seasons[]=2023": self.season,
+            "seasons[]": self.season,
             "per_page": 100
         }
-        collected_data = []
-        self._fetch_pagination_data(url=url, collected_data=collected_data, params=params, next_cursor=cursor)
+        
+        if self.mode == "window":
+            params["start_date"], params["end_date"] = self._window()
+            self.logger.info(f"Extracting games from {params['start_date']} to {params['end_date']}")
+        elif self.mode == "increment" and self._last_final_date():
+            # The whole schedule is published up front, so an id cursor finds nothing once it is loaded.
+            # Games played since the last final game are fetched again by date to get their status and scores,
+            # starting on its date as another game of that day may not have been final yet.
+            params.update(self._final_games_range(days_after=0))
+            self.logger.info(f"Extracting games from {params['start_date']} to {params['end_date']}")
+        else:
+            # Full runs, and increment runs without a final game checkpoint yet, fetch the whole schedule
+            self.logger.info(f"Extracting the {self.season} schedule")
+        
+        # Games played since the last run change status and score, so dated fetches are not answered from the cache
+        collected_data = RecordStore()
+        with get_metrics().timer("extract", endpoint="games"):
+            self._fetch_pagination_data(url=url, collected_data=collected_data, params=params, revalidate="start_date" in params)
+        
+        # The next window starts at the last final game, saved with the other checkpoints once loaded
+        final_dates = [game_date[:10] for status, game_date in zip(collected_data.column("status"), collected_data.column("date")) if status == "Final" and game_date]
+        if len(final_dates) > 0:
+            with self.cursors_lock:
+                self.cursors[self._checkpoint_key("games_final_date")] = max(final_dates)
             
         return collected_data
 
+    def has_new_final_games(self) -> bool:
+        # Cheap probe for scheduled refreshes: stats only change once a game is final, so a target whose
+        # last loaded final game is still the latest one has nothing new to load
+        if not self._last_final_date():
+            return True
+        return self.latest_final_date() is not None
+    
+    def latest_final_date(self):
+        # Date of the latest game that became final after the checkpointed one, None when there is none
+        if not self._last_final_date():
+            return None
+        
+        url = f"{self.base_url}/games"
+        params = dict({"team_ids[]": self.team_id, "seasons[]": self.season, "per_page": 100}, **self._final_games_range())
+        final_dates = []
+        with get_metrics().timer("extract", endpoint="probe"):
+            for page_data, _ in self._iter_pagination_data(url=url, params=params, revalidate=True):
+                final_dates += [game.get("date")[:10] for game in page_data if game.get("status") == "Final" and game.get("date")]
+        return max(final_dates) if len(final_dates) > 0 else None
+    
+    def _final_games_range(self, days_after: int = 1):
+        # Every game after the last final one up to today, the games that may have been played since
+        return {
+            "start_date": (date.fromisoformat(self._last_final_date()) + timedelta(days=days_after)).isoformat(),
+            "end_date": self.end_date or date.today().isoformat(),
+        }
+    
+    def _last_final_date(self):
+        return self.checkpoint_store.get(self._checkpoint_key("games_final_date")) if self.checkpoint_store else None
+    
     def extract_players_stats(self, player_ids):
         if not player_ids or len(player_ids) == 0:
-            return []
+            return RecordStore()
         
-        cursor = 0
-        if self.mode == "increment":
-            cursor = self.sql_client.select_max_id(f"{self.team_name}_{self.season}_players_performance")
-            self.logger.info(f"Extracting players stats cursor: {cursor}")
-            
+        return self._fetch_stats(self._players_stats_params(player_ids), checkpointed=True)
+    
+    def extract_games_stats(self, game_ids):
+        # Box scores of the given games, used by window runs instead of paging every player's season
+        if not game_ids or len(game_ids) == 0:
+            return RecordStore()
+        
+        params = [{"game_ids[]": chunk_ids, "per_page": 100} for chunk_ids in self._id_chunks(sorted(game_ids), "game_ids[]")]
+        # A box score also holds the opponent's players
+        return self._fetch_stats(params, checkpointed=False).filter("team.id", lambda team_id: team_id == int(self.team_id))
+    
+    def _fetch_stats(self, shards_params, checkpointed: bool):
         url = f"{self.base_url}/stats"
-        params = {
-            "seasons[]": self.season,
-            "player_ids[]": player_ids,
-            "per_page": 100 
-        }
         
-        collected_data = []
-        self._fetch_pagination_data(url=url, collected_data=collected_data, params=params, next_cursor=cursor)
+        # Each shard (player chunk x date range, or game chunk) has its own cursor chain, so the chains are paged concurrently.
+        # Shards can overlap when a stat falls on a date range boundary or a player appears twice, the store keeps one row per stat.
+        collected_data = RecordStore()
+        
+        def fetch_chunk(params):
+            checkpoint_key, cursor = None, None
+            if checkpointed:
+                checkpoint_key = self._players_stats_checkpoint_key(params)
+                cursor = self._players_stats_cursor(checkpoint_key)
+            self._fetch_pagination_data(url=url, collected_data=collected_data, params=params, next_cursor=cursor, checkpoint_key=checkpoint_key)
+        
+        with get_metrics().timer("extract", endpoint="stats"), ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            list(executor.map(fetch_chunk, shards_params))
        
         return collected_data
+    
+    def stream_players_stats(self, player_ids, batch_size: int = 1000):
+        # Yields bounded batches of stats as pages arrive instead of collecting the whole season
+        if not player_ids or len(player_ids) == 0:
+            return
+        
+        url = f"{self.base_url}/stats"
+        shards_params = self._players_stats_params(player_ids)
+        
+        # Shards are paged concurrently as in `_fetch_stats`. Their pages are handed over through a bounded queue,
+        # so a consumer busy loading a batch holds the fetches back instead of buffering the season.
+        pages = queue.Queue(maxsize=self.max_workers * 2)
+        stopped = threading.Event()
+        
+        def hand_over(item):
+            while not stopped.is_set():
+                try:
+                    pages.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+        
+        def fetch_shard(params):
+            checkpoint_key = self._players_stats_checkpoint_key(params)
+            try:
+                for page_data, _ in self._iter_pagination_data(url=url, params=params, next_cursor=self._players_stats_cursor(checkpoint_key)):
+                    if stopped.is_set():
+                        return
+                    hand_over((checkpoint_key, page_data, None))
+            except Exception as e:
+                hand_over((checkpoint_key, None, e))
+                return
+            hand_over((checkpoint_key, None, None))
+        
+        # The cursors returned by `pending_checkpoints` while a batch is yielded cover exactly the pages up to that batch,
+        # so a shard's cursor only moves once its page is in a batch, not when a worker fetched it
+        batch = RecordStore()
+        seen_ids = set()
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            for params in shards_params:
+                executor.submit(fetch_shard, params)
+            
+            # Time spent by the consumer between batches is not counted as extraction time
+            started_at, started_cpu = time.perf_counter(), time.thread_time()
+            running = len(shards_params)
+            while running > 0:
+                checkpoint_key, page_data, error = pages.get()
+                if error is not None:
+                    raise error
+                if page_data is None:
+                    running -= 1
+                    continue
+                
+                # Stats of earlier batches are already loaded, repeats within the batch are deduplicated by the store
+                batch.add([stat for stat in page_data if stat.get("id") not in seen_ids])
+                if len(page_data) > 0:
+                    with self.cursors_lock:
+                        self.cursors[checkpoint_key] = max(stat.get("id") for stat in page_data)
+                if len(batch) >= batch_size:
+                    get_metrics().record_time("extract", time.perf_counter() - started_at, time.thread_time() - started_cpu, endpoint="stats")
+                    seen_ids.update(batch.ids())
+                    yield batch
+                    batch = RecordStore()
+                    started_at, started_cpu = time.perf_counter(), time.thread_time()
+            
+            get_metrics().record_time("extract", time.perf_counter() - started_at, time.thread_time() - started_cpu, endpoint="stats")
+        finally:
+            # Also reached when the consumer stops early, the workers give up instead of waiting on a full queue
+            stopped.set()
+            executor.shutdown(wait=True)
+        
+        if len(batch) > 0:
+            yield batch
+    
+    def pending_checkpoints(self) -> dict:
+        with self.cursors_lock:
+            return dict(self.cursors)
+    
+    def save_checkpoints(self, cursors: dict = None) -> None:
+        if not self.checkpoint_store:
+            return
+        cursors = self.pending_checkpoints() if cursors is None else cursors
+        self.checkpoint_store.save(cursors)
+        self.logger.info(f"Saved {len(cursors)} checkpoints. Team ID: {self.team_id}, Season: {self.season}")
+    
+    def _extract_window(self):
+        team_players = self.extract_players()
+        self.logger.info(f"Extracted players data on season {self.season}. Size: {len(team_players)}")
+        
+        team_games = self.extract_games()
+        self.logger.info(f"Extracted games data on season {self.season}. Size: {len(team_games)}")
+        
+        # Box scores are only loaded once a game is final, so running totals never count a partial game
+        final_game_ids = team_games.filter("status", lambda status: status == "Final").ids()
+        players_stats = self.extract_games_stats(final_game_ids)
+        self.logger.info(f"Extracted players stats data of {len(final_game_ids)} final games. Size: {len(players_stats)}")
+        
+        return team_players, team_games, players_stats
+    
+    def _window(self):
+        start_date = self.start_date
+        if not start_date and self.checkpoint_store:
+            start_date = self.checkpoint_store.get(self._checkpoint_key("games_final_date"))
+        if not start_date:
+            start_date = (date.today() - timedelta(days=self.window_days)).isoformat()
+        return start_date, self.end_date or date.today().isoformat()
+    
+    def _checkpoint_key(self, endpoint: str, chain: str = None):
+        key = f"{endpoint}/{self.team_id}/{self.season}"
+        return f"{key}/{chain}" if chain else key
+    
+    def _cursor(self, checkpoint_key: str, file_name: str):
+        if self.mode != "increment":
+            return 0
+        
+        checkpoint = self.checkpoint_store.get(checkpoint_key) if self.checkpoint_store else None
+        if checkpoint is not None:
+            return checkpoint
+        # Tables loaded before checkpoints existed resume from their last loaded id
+        if self.layout == "partitioned":
+            return self.sql_client.select_max_id(file_name, {"teamId": int(self.team_id), "season": int(self.season)})
+        return self.sql_client.select_max_id(f"{self.team_name}_{self.season}_{file_name}")
+    
+    def _players_stats_cursor(self, checkpoint_key: str):
+        cursor = self._cursor(checkpoint_key, "players_performance")
+        self.logger.info(f"Extracting players stats cursor: {cursor}. Checkpoint: {checkpoint_key}")
+        return cursor
+    
+    def _players_stats_checkpoint_key(self, params):
+        # A shard's cursor chain is identified by its players and date range, which stay the same while the roster is unchanged
+        chain = ",".join(str(player_id) for player_id in params["player_ids[]"])
+        if "start_date" in params or "end_date" in params:
+            chain = f"{chain}|{params.get('start_date', '')}|{params.get('end_date', '')}"
+        return self._checkpoint_key("stats", hashlib.sha1(chain.encode()).hexdigest()[:12])
+    
+    def _players_stats_params(self, player_ids):
+        date_ranges = self._season_date_ranges()
+        return [
+            dict(
+                {
+                    "seasons[]": self.season,
+                    "player_ids[]": chunk_ids,
+                    "per_page": 100 
+                },
+                **date_range
+            )
+            for chunk_ids in self._id_chunks(sorted(player_ids), "player_ids[]")
+            for date_range in date_ranges
+        ]
+    
+    def _id_chunks(self, ids, param_name: str):
+        # Chunks hold at most `stats_chunk_size` ids and keep the query string under MAX_QUERY_LENGTH
+        base_length = len(f"{self.base_url}/stats?seasons%5B%5D={self.season}&per_page=100&cursor=0000000000&start_date=0000-00-00&end_date=0000-00-00")
+        chunks = []
+        chunk_ids, query_length = [], base_length
+        for item_id in ids:
+            id_length = len(f"&{quote(param_name)}={item_id}")
+            if len(chunk_ids) > 0 and (len(chunk_ids) >= self.stats_chunk_size or query_length + id_length > MAX_QUERY_LENGTH):
+                chunks.append(chunk_ids)
+                chunk_ids, query_length = [], base_length
+            chunk_ids.append(item_id)
+            query_length += id_length
+        if len(chunk_ids) > 0:
+            chunks.append(chunk_ids)
+        return chunks
+    
+    def _season_date_ranges(self):
+        if self.stats_date_shards <= 1:
+            return [{}]
+        
+        # An NBA season usually runs from October to the end of the June finals. The first and last shards are
+        # left open, so games outside those months (the 2020 bubble, the July 2021 finals) are still fetched.
+        season_start, season_end = date(int(self.season), 10, 1), date(int(self.season) + 1, 6, 30)
+        shard_days = ((season_end - season_start).days + 1) / self.stats_date_shards
+        date_ranges = []
+        for shard in range(self.stats_date_shards):
+            date_range = {}
+            if shard > 0:
+                date_range["start_date"] = (season_start + timedelta(days=round(shard * shard_days))).isoformat()
+            if shard < self.stats_date_shards - 1:
+                date_range["end_date"] = (season_start + timedelta(days=round((shard + 1) * shard_days) - 1)).isoformat()
+            date_ranges.append(date_range)
+        return date_ranges
 
-
-    def _fetch_data(self, url: str, params=None):
+    def _fetch_data(self, url: str, params=None, revalidate=False):
         headers = {
             "Authorization": f"{self.api_key}"
         }
-        response = requests.get(url=url, params=params, headers=headers)
+        response = self.http_client.get(url=url, params=params, headers=headers, revalidate=revalidate)
         if response.status_code == 200:
             return response.json()
         elif response.status_code == 429:
@@ -105,36 +388,47 @@ class ExtractBalldontlie:
                 f"Failed to fetch data. Status Code: {response.status_code}. Response: {response.text}"
             )
             
-    def _fetch_pagination_data(self, url: str, collected_data, params=None, next_cursor=None, max_retries=5):
-        if next_cursor:
-            params['cursor'] = next_cursor
-
+    def _fetch_data_with_retries(self, url: str, params=None, max_retries=5, revalidate=False):
         retries = 0
-        backoff_factor = 3
 
         while True:
             try:
-                response = self._fetch_data(url, params)
-                
-                collected_data.extend(response.get('data', []))
-                next_cursor = response.get('meta', {}).get('next_cursor')
-                
-                if not next_cursor:
-                    break
-                
-                params['cursor'] = next_cursor
+                return self._fetch_data(url, params, revalidate)
             except requests.exceptions.HTTPError as e:
                 if e.response.status_code == 429:
+                    # The shared rate limiter already paused every fetch for Retry-After, so retry right away
                     if retries < max_retries:
                         retries += 1
-                        sleep_time = backoff_factor * (2 ** (retries - 1))
-                        self.logger.warning(f"Rate limit exceeded. Retrying in {sleep_time} seconds...")
-                        time.sleep(sleep_time)
+                        self.logger.warning(f"Rate limit exceeded. Retrying (attempt {retries} of {max_retries})...")
+                        continue
                     else:
                         self.logger.error(f"Max retries exceeded. Failed to fetch data after {max_retries} attempts.")
                         raise e
                 else:
                     self.logger.error(f"Failed to fetch data: {e}")
                     raise e
-            
+
+    def _fetch_pagination_data(self, url: str, collected_data: RecordStore, params=None, next_cursor=None, max_retries=5, checkpoint_key=None, revalidate=False):
+        # A page fetched again after a retry or a resumed cursor replaces its records instead of repeating them
+        for page_data, _ in self._iter_pagination_data(url, params, next_cursor, max_retries, checkpoint_key, revalidate):
+            collected_data.add(page_data)
     
+    def _iter_pagination_data(self, url: str, params=None, next_cursor=None, max_retries=5, checkpoint_key=None, revalidate=False):
+        # Yields (page data, cursor of the next page) for every page of the cursor chain
+        if next_cursor:
+            params['cursor'] = next_cursor
+
+        while True:
+            response = self._fetch_data_with_retries(url, params, max_retries, revalidate)
+            page_data = response.get('data', [])
+            next_cursor = response.get('meta', {}).get('next_cursor')
+            if checkpoint_key and len(page_data) > 0:
+                # Cursors are record ids, so the chain resumes after the last record of this page
+                with self.cursors_lock:
+                    self.cursors[checkpoint_key] = max(record.get("id") for record in page_data)
+            yield page_data, next_cursor
+            
+            if not next_cursor:
+                break
+            
+            params['cursor'] = next_cursor
@@ -1,8 +1,21 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
 from jinja2 import Environment
 from pandas import DataFrame
 from etl.connectors.postgresql import PostgreSqlClient
+from etl.connectors.metrics import get_metrics
 from logging import Logger
 
+SEASON_TABLES = ["players", "games", "players_performance", "players_overall_performance"]
+# Partitioned layout: one table per entity for every team, partitioned by season
+PARTITION_COLUMNS = ["teamId", "season"]
+TEAMS_TABLE = "teams"
+# Outputs derived in the database from the loaded facts: (view, view template, source table)
+DERIVED_VIEWS = [
+    ("players_overall_performance", "players_overall_performance_view", "players_performance"),
+    ("games_record", "games_record_view", "games"),
+]
+
 class LoadBalldontlie:
     def __init__(
         self, 
@@ -17,6 +30,11 @@ class LoadBalldontlie:
         df_players_performance: DataFrame,
         df_players_overall_performance: DataFrame,
         chunk_size: int = 500,
+        load_method: str = "copy",
+        max_workers: int = 5,
+        layout: str = "per_team",
+        team_id: int = None,
+        derive_in_db: bool = False,
     ):
         self.tables_template = tables_template
         self.sql_client = sql_client
@@ -29,54 +47,250 @@ class LoadBalldontlie:
         self.df_players_performance = df_players_performance
         self.df_players_overall_performance = df_players_overall_performance
         self.chunk_size = chunk_size
+        self.load_method = load_method
+        self.max_workers = max_workers
+        self.layout = layout
+        self.team_id = team_id
+        # The overall performance and the cumulative record become materialized views, refreshed after each commit.
+        # The league-wide views of the partitioned layout are refreshed once per batch instead, see `refresh_league_views`.
+        self.derive_in_db = derive_in_db
+        self.season_tables = [file_name for file_name in SEASON_TABLES if not derive_in_db or file_name != "players_overall_performance"]
+        # Full loads write into shadow tables that are swapped in once everything is loaded
+        self.use_shadow_tables = False
+        # Incremental runs merge new stats into running totals instead of rewriting the overall performance
+        self.accumulate_overall = False
+        # Runs that fetch part of the season count the cumulative record over every loaded game instead
+        self.recount_record = False
+        # Partitioned full loads replace the team's rows of the season, each table the first time it is written
+        self.replace_scope = False
+        self.replaced_tables = set()
+        self.replaced_lock = Lock()
+        # Inserted/updated/unchanged row counts per table for this run
+        self.load_report = {}
         
     def load(self, mode: str):
-        if(mode == "full"):
-            self.sql_client.drop_tables(self.team_name, self.season)
-        self.load_team("team")
-        self.load_team_players("players")
-        self.load_team_games("games")
-        self.load_players_performance("players_performance")
-        self.load_players_overall_performance("players_overall_performance")
+        self.begin(mode)
+        self.load_tables()
+        self.commit()
+    
+    def begin(self, mode: str):
+        if not self.derive_in_db:
+            # Left by runs that derived in the database, the overall performance is a table again
+            self.sql_client.drop_materialized_views([view_name for view_name, _, _ in self._derived_views()])
+        
+        if self.layout == "partitioned":
+            for file_name in self.season_tables:
+                self.sql_client.create_partition(file_name, f"partitioned/{file_name}", self.tables_template, self.season)
+            self.sql_client.ensure_column("players_performance", "playerTeamId", "INT")
+        
+        if mode != "full":
+            self.accumulate_overall = not self.derive_in_db
+            self.recount_record = not self.derive_in_db
+            return
+        
+        if self.layout == "partitioned":
+            self.replace_scope = True
+            return
+        
+        self.use_shadow_tables = True
+        for file_name in self.season_tables:
+            shadow_table_name = self._table_name(file_name)
+            # Left over by a run that failed before the swap
+            self.sql_client.drop_table(shadow_table_name)
+            self.sql_client.create_table(shadow_table_name, file_name, self.tables_template)
+    
+    def load_tables(self):
+        # Tables are independent, so each is written concurrently in its own transaction
+        loads = [
+            (self.load_team, "team"),
+            (self.load_team_players, "players"),
+            (self.load_team_games, "games"),
+            (self.load_players_performance, "players_performance"),
+            (self.load_players_overall_performance, "players_overall_performance"),
+        ]
+        def timed_load(load, file_name):
+            with get_metrics().timer("load", table=file_name):
+                load(file_name)
+        
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(timed_load, load, file_name) for load, file_name in loads]
+            for future in futures:
+                future.result()
+    
+    def commit(self):
+        if self.replace_scope:
+            # Tables this run had no rows for still lose the team's previous rows
+            with self.sql_client.transaction() as connection:
+                for file_name in self.season_tables:
+                    if file_name not in self.replaced_tables:
+                        self.sql_client.delete_scope(self._table_name(file_name), self._scope(), connection)
+            self.replace_scope = False
+        
+        if self.use_shadow_tables:
+            table_names = [(self._table_name(file_name, shadow=False), self._table_name(file_name)) for file_name in self.season_tables]
+            with get_metrics().timer("load", table="swap_tables"), self.sql_client.transaction() as connection:
+                self.sql_client.swap_tables(table_names, connection)
+                # The swap drops the views over the old tables, they are created over the new ones before the swap is visible
+                if self.derive_in_db:
+                    self.refresh_derived(connection)
+            self.use_shadow_tables = False
+        elif self.derive_in_db and self.layout != "partitioned":
+            self.refresh_derived()
+    
+    def refresh_derived(self, connection=None):
+        for view_name, view_file_name, source_table_name in self._derived_views():
+            # In the swap transaction every source was just swapped in, other connections may not see it yet
+            if connection is None and not self.sql_client.table_exists(source_table_name):
+                continue
+            with get_metrics().timer("load", table=view_file_name):
+                self.sql_client.refresh_materialized_view(
+                    view_name, view_file_name, self.tables_template, connection, source_table_name=source_table_name, scope_columns=[]
+                )
+    
+    @staticmethod
+    def refresh_league_views(sql_client: PostgreSqlClient, tables_template: Environment):
+        # The partitioned layout's views cover every team and season, a full refresh per target would redo the whole league each time
+        for view_name, view_file_name, source_table_name in DERIVED_VIEWS:
+            if not sql_client.table_exists(source_table_name):
+                continue
+            with get_metrics().timer("load", table=view_file_name):
+                sql_client.refresh_materialized_view(
+                    view_name, view_file_name, tables_template, source_table_name=source_table_name, scope_columns=PARTITION_COLUMNS
+                )
+    
+    def _derived_views(self):
+        # (view name, view template, source table name), league-wide views over the partitioned tables
+        if self.layout == "partitioned":
+            return DERIVED_VIEWS
+        return [(f"{self.team_name}_{self.season}_{view}", view_file_name, f"{self.team_name}_{self.season}_{source}") for view, view_file_name, source in DERIVED_VIEWS]
   
     def load_team(self, file_name: str):
         if len(self.df_team) == 0:
             return
         
-        table_name = f"{self.team_name}_{file_name}"
+        if self.layout == "partitioned":
+            table_name, file_name = TEAMS_TABLE, f"partitioned/{file_name}"
+        else:
+            table_name = f"{self.team_name}_{file_name}"
         self.logger.info(f"Loaded team data. Size: {len(self.df_team)}. Table: {table_name}")
-        self.sql_client.upsert(self.df_team, self.tables_template, table_name, file_name, self.chunk_size)
+        self._upsert(self.df_team, table_name, file_name)
         
     def load_team_players(self, file_name: str):
         if len(self.df_team_players) == 0:
             return
         
-        table_name = f"{self.team_name}_{self.season}_{file_name}"
+        table_name = self._table_name(file_name)
         self.logger.info(f"Loaded team players data. Size: {len(self.df_team_players)}. Table: {table_name}")
-        self.sql_client.upsert(self.df_team_players, self.tables_template, table_name, file_name, self.chunk_size)
+        self._upsert(self.df_team_players, table_name, file_name)
         
     def load_team_games(self, file_name: str):
         if len(self.df_team_games) == 0:
             return
         
-        table_name = f"{self.team_name}_{self.season}_{file_name}"
+        table_name = self._table_name(file_name)
         self.logger.info(f"Loaded team games data. Size: {len(self.df_team_games)}. Table: {table_name}")
-        self.sql_client.upsert(self.df_team_games, self.tables_template, table_name, file_name, self.chunk_size)
+        if not self.recount_record:
+            self._upsert(self.df_team_games, table_name, file_name)
+            return
+        
+        with self.sql_client.transaction() as connection:
+            self._upsert(self.df_team_games, table_name, file_name, connection)
+            self.sql_client.recount_record(
+                "games_record_recount", self.tables_template, table_name, connection, self._scope() if self.layout == "partitioned" else None
+            )
     
     def load_players_performance(self, file_name: str):
         if len(self.df_players_performance) == 0:
             return
         
-        table_name = f"{self.team_name}_{self.season}_{file_name}"
+        table_name = self._table_name(file_name)
         self.logger.info(f"Loaded players performance data. Size: {len(self.df_players_performance)}. Table: {table_name}")
-        self.sql_client.upsert(self.df_players_performance, self.tables_template, table_name, file_name, self.chunk_size)
+        self._upsert_performance(self.df_players_performance, table_name, file_name)
     
     def load_players_overall_performance(self, file_name: str):
-        if len(self.df_players_overall_performance) == 0:
+        if len(self.df_players_overall_performance) == 0 or self.accumulate_overall or self.derive_in_db:
             return
         
-        table_name = f"{self.team_name}_{self.season}_{file_name}"
+        table_name = self._table_name(file_name)
         self.logger.info(f"Loaded players overall performance data. Size: {len(self.df_players_overall_performance)}. Table: {table_name}")
-        self.sql_client.upsert(self.df_players_overall_performance, self.tables_template, table_name, file_name, self.chunk_size)
+        self._upsert(self.df_players_overall_performance, table_name, file_name)
+        
+    def load_players_performance_batch(self, df_players_performance: DataFrame, file_name: str = "players_performance"):
+        # Streaming runs upsert each transformed batch as soon as it is ready
+        if len(df_players_performance) == 0:
+            return
+        
+        table_name = self._table_name(file_name)
+        self.logger.info(f"Loaded players performance batch. Size: {len(df_players_performance)}. Table: {table_name}")
+        with get_metrics().timer("load", table=file_name):
+            self._upsert_performance(df_players_performance, table_name, file_name)
     
-    
\ No newline at end of file
+    def _table_name(self, file_name: str, shadow: bool = None):
+        # Rows are written to the season partition directly, RETURNING xmax is not supported on the partitioned table
+        if self.layout == "partitioned":
+            return f"{file_name}_{self.season}"
+        
+        shadow = self.use_shadow_tables if shadow is None else shadow
+        table_name = f"{self.team_name}_{self.season}_{file_name}"
+        return f"{table_name}_shadow" if shadow else table_name
+    
+    def _upsert_performance(self, df: DataFrame, table_name: str, file_name: str):
+        if not self.accumulate_overall:
+            self._upsert(df, table_name, file_name)
+            return
+        
+        # Only stats rows inserted by this transaction are added to the totals, so retried batches are not counted twice
+        with self.sql_client.transaction() as connection:
+            inserted_ids = self._upsert(df, table_name, file_name, connection)
+            if len(inserted_ids) > 0:
+                self.sql_client.accumulate(
+                    "players_overall_performance_accumulate",
+                    self.tables_template,
+                    self._table_name("players_overall_performance"),
+                    "players_overall_performance",
+                    table_name,
+                    inserted_ids,
+                    connection,
+                    self._scope() if self.layout == "partitioned" else None,
+                )
+    
+    def _scope(self) -> dict:
+        return {"teamId": int(self.team_id), "season": int(self.season)}
+    
+    def _upsert(self, df: DataFrame, table_name: str, file_name: str, connection=None):
+        if self.layout == "partitioned" and file_name in SEASON_TABLES:
+            return self._upsert_partitioned(df, table_name, file_name, connection)
+        
+        counts = self.sql_client.upsert(df, self.tables_template, table_name, file_name, self.chunk_size, self.load_method, connection)
+        return self._report(table_name, counts)
+    
+    def _upsert_partitioned(self, df: DataFrame, table_name: str, file_name: str, connection=None):
+        if connection is None:
+            with self.sql_client.transaction() as connection:
+                return self._upsert_partitioned(df, table_name, file_name, connection)
+        
+        if file_name == "players_performance":
+            # "teamId" is the load scope, a stat keeps the team it was played for so a traded player's earlier games stay with that team
+            df = df.rename(columns={"teamId": "playerTeamId"})
+        df = df.assign(**self._scope())
+        
+        # The delete shares the transaction of the first upsert, readers see either the old or the new rows
+        with self.replaced_lock:
+            replace = self.replace_scope and file_name not in self.replaced_tables
+            self.replaced_tables.add(file_name)
+        if replace:
+            self.sql_client.delete_scope(table_name, self._scope(), connection)
+        
+        counts = self.sql_client.upsert(
+            df, self.tables_template, table_name, f"partitioned/{file_name}", self.chunk_size, self.load_method, connection, ["id", *PARTITION_COLUMNS]
+        )
+        return self._report(table_name, counts)
+    
+    def _report(self, table_name: str, counts: dict):
+        inserted_ids = counts.pop("inserted_ids")
+        
+        report = self.load_report.setdefault(table_name.removesuffix("_shadow"), {"inserted": 0, "updated": 0, "unchanged": 0})
+        for key, value in counts.items():
+            report[key] += value
+        self.logger.info(f"Table {table_name}: {counts['inserted']} inserted, {counts['updated']} updated, {counts['unchanged']} unchanged")
+        return inserted_ids
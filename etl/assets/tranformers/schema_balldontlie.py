@@ -0,0 +1,91 @@
+from pandas import CategoricalDtype, DataFrame
+from pandas.api.types import is_float_dtype, is_integer_dtype
+
+PERFORMANCE = CategoricalDtype(['bad', 'ok', 'good'], ordered=True)
+RESULT = CategoricalDtype(['Win', 'Loss'])
+
+# Compact dtypes for every output table: categoricals for low-cardinality labels,
+# nullable small ints for counts and float32 for percentages and averages
+SCHEMAS = {
+    "team": {
+        'id': 'Int32',
+    },
+    "players": {
+        'id': 'Int32',
+        'position': 'category',
+        'country': 'category',
+        'yearsSinceDraft': 'Int8',
+        'teamId': 'Int32',
+    },
+    "games": {
+        'id': 'Int32',
+        'season': 'Int16',
+        'postseason': 'boolean',
+        'opponentTeam': 'category',
+        'status': 'category',
+        'opponentTeamConference': 'category',
+        'isHomeGame': 'boolean',
+        'totalPoints': 'Int16',
+        'homeTeamScore': 'Int16',
+        'visitorTeamScore': 'Int16',
+        'result': RESULT,
+        'cumulativeWins': 'Int32',
+        'cumulativeLosses': 'Int32',
+    },
+    "players_performance": {
+        'id': 'Int32',
+        'gameId': 'Int32',
+        'playerId': 'Int32',
+        'teamId': 'Int32',
+        'minutesPlayed': 'Int16',
+        'fieldGoalsMade': 'Int8',
+        'fieldGoalsAttempted': 'Int8',
+        'fieldGoalPercentage': 'float32',
+        'fieldGoalPerformance': PERFORMANCE,
+        'threePointsFieldGoalsMade': 'Int8',
+        'threePointsFieldGoalsAttempted': 'Int8',
+        'threePointsFieldGoalPercentage': 'float32',
+        'threePointsFieldGoalPerformance': PERFORMANCE,
+        'freeThrowsMade': 'Int8',
+        'freeThrowsAttempted': 'Int8',
+        'freeThrowsPercentage': 'float32',
+        'freeThrowsPerformance': PERFORMANCE,
+        'offensiveRebounds': 'Int8',
+        'defensiveRebounds': 'Int8',
+        'rebounds': 'Int8',
+        'assists': 'Int8',
+        'steals': 'Int8',
+        'blocks': 'Int8',
+        'personalFouls': 'Int8',
+        'points': 'Int16',
+    },
+    "players_overall_performance": {
+        'id': 'Int32',
+        'gamesPlayed': 'Int16',
+        'totalMinutesPlayed': 'Int32',
+        'averageMinutesPlayedPerGame': 'float32',
+        'totalFieldGoalsAttempted': 'Int32',
+        'totalFieldGoalsMade': 'Int32',
+        'fieldGoalPercentage': 'float32',
+        'totalThreePointsAttempted': 'Int32',
+        'totalThreePointsMade': 'Int32',
+        'threePointsPercentage': 'float32',
+        'totalFreeThrowsAttempted': 'Int32',
+        'totalFreeThrowsMade': 'Int32',
+        'freeThrowsPercentage': 'float32',
+        'totalAssists': 'Int32',
+        'totalPoints': 'Int32',
+    },
+}
+
+def apply_schema(df: DataFrame, table: str) -> DataFrame:
+    if len(df) == 0:
+        return df
+
+    dtypes = {column: dtype for column, dtype in SCHEMAS[table].items() if column in df.columns}
+    # Float counts (coerced minutes, sums over NaN) are rounded before becoming integers
+    rounded = {
+        column: df[column].round() for column, dtype in dtypes.items() if is_integer_dtype(dtype) and is_float_dtype(df[column])
+    }
+
+    return df.assign(**rounded).astype(dtypes)
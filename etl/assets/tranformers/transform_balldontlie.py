@@ -1,21 +1,76 @@
-from pandas import DataFrame, json_normalize, to_numeric
+from pandas import DataFrame, concat, to_numeric
+from pandas import Categorical
 from datetime import datetime
+import numpy as np
+from etl.assets.tranformers.schema_balldontlie import PERFORMANCE, apply_schema
+from etl.connectors.metrics import get_metrics
+from etl.connectors.landing_zone import LandingZone
+from etl.connectors.record_store import RecordStore
 from logging import Logger
 
+STATS_COLUMNS = {
+    'id': 'id',
+    'game.id': 'gameId',
+    'player.id': 'playerId',
+    'team.id': 'teamId',
+    'min': 'minutesPlayed',
+    'fgm': 'fieldGoalsMade',
+    'fga': 'fieldGoalsAttempted',
+    'fg3m': 'threePointsFieldGoalsMade',
+    'fg3a': 'threePointsFieldGoalsAttempted',
+    'ftm': 'freeThrowsMade',
+    'fta': 'freeThrowsAttempted',
+    'oreb': 'offensiveRebounds',
+    'dreb': 'defensiveRebounds',
+    'reb': 'rebounds',
+    'ast': 'assists',
+    'stl': 'steals',
+    'blk': 'blocks',
+    'pf': 'personalFouls',
+    'pts': 'points'
+}
+
 class TransformBalldontlie:
-    def __init__(self, logger: Logger, team_data: dict, team_players_data: list[dict], team_games_data: list[dict], players_stats_data: list[dict]):
+    def __init__(self, logger: Logger, team_data: dict, team_players_data: RecordStore, team_games_data: RecordStore, players_stats_data: RecordStore, derive_in_db: bool = False, partial_season: bool = False):
         self.team_data = team_data
         self.team_players_data = team_players_data
         self.team_games_data = team_games_data
         self.players_stats_data = players_stats_data
         self.logger=logger
+        # Outputs derived from other rows (overall performance, cumulative record) are left to the database
+        self.derive_in_db = derive_in_db
+        # Window and increment runs only see a slice of the season's games, the loader counts the record over every loaded game instead
+        self.partial_season = partial_season
+        self._players_stats_frame = None
+    
+    @classmethod
+    def from_landing_zone(cls, logger: Logger, landing_zone: LandingZone, team_id: int, season: str, until_date: str = None, derive_in_db: bool = False):
+        # Replays landed raw records, transforms and backfills run without any API call
+        teams = landing_zone.read("team", team_id, season, until_date, snapshot=True)
+        if len(teams) == 0:
+            raise Exception(f"No landed data for Team ID: {team_id}, Season: {season}")
+        
+        return cls(
+            logger=logger,
+            team_data=teams.records()[0],
+            team_players_data=landing_zone.read("players", team_id, season, until_date, snapshot=True),
+            team_games_data=landing_zone.read("games", team_id, season, until_date),
+            players_stats_data=landing_zone.read("stats", team_id, season, until_date),
+            derive_in_db=derive_in_db,
+        )
 
     def transform(self):
-        df_team = self.team()
-        df_team_players = self.team_players()
-        df_team_games = self.team_games(self.team_data['id'])
-        df_players_performance = self.team_players_performance()
-        df_players_overall_performance = self.team_players_overall_performance()
+        metrics = get_metrics()
+        with metrics.timer("transform", table="team"):
+            df_team = self.team()
+        with metrics.timer("transform", table="players"):
+            df_team_players = self.team_players()
+        with metrics.timer("transform", table="games"):
+            df_team_games = self.team_games(self.team_data['id'])
+        with metrics.timer("transform", table="players_performance"):
+            df_players_performance = self.team_players_performance()
+        with metrics.timer("transform", table="players_overall_performance"):
+            df_players_overall_performance = DataFrame() if self.derive_in_db else self.team_players_overall_performance()
         
         return df_team, df_team_players, df_team_games, df_players_performance, df_players_overall_performance
     
@@ -25,6 +80,7 @@ class TransformBalldontlie:
         
         df_team = DataFrame(self.team_data, index=[0])
         df_team.rename(columns={'full_name': 'fullName'}, inplace=True)
+        df_team = apply_schema(df_team, "team")
         self.logger.info(f"Transformed team data")
         return df_team
     
@@ -32,14 +88,15 @@ class TransformBalldontlie:
         if not self.team_players_data or len(self.team_players_data) == 0:
             return DataFrame()
         
-        df_team = DataFrame(self.team_players_data)
+        df_team = self._frame(self.team_players_data)
         df_team.rename(columns={'jersey_number': 'jerseyNumber'}, inplace=True)
         df_team['fullName'] = df_team['first_name'] + ' ' + df_team['last_name']
-        df_team['teamId'] = df_team['team'].apply(lambda x: x['id'])
+        self._flatten(df_team, 'team', ['id'])
+        df_team['teamId'] = df_team['team.id']
         # Handling NaN values and ensuring the 'years_since_draft' is an integer
         df_team['yearsSinceDraft'] = (datetime.now().year - df_team['draft_year']).fillna(-1).astype(int)
 
-        df_final = df_team[['id', 'fullName', 'position', 'height', 'weight', 'jerseyNumber', 'college', 'country', 'yearsSinceDraft', 'teamId']]
+        df_final = apply_schema(df_team[['id', 'fullName', 'position', 'height', 'weight', 'jerseyNumber', 'college', 'country', 'yearsSinceDraft', 'teamId']], "players")
 
         self.logger.info(f"Transformed players data. Size: {len(df_final)}")
         return df_final
@@ -48,24 +105,30 @@ class TransformBalldontlie:
         if not self.team_games_data or len(self.team_games_data) == 0:
             return DataFrame()
         
-        df_team = DataFrame(self.team_games_data)
+        df_team = self._frame(self.team_games_data)
         df_team.rename(columns={'home_team_score': 'homeTeamScore', 'visitor_team_score': 'visitorTeamScore'}, inplace=True)
 
         df_team['totalPoints'] = df_team['homeTeamScore'] + df_team['visitorTeamScore']
 
-        df_team['opponentTeam'] = df_team.apply(lambda row: row['visitor_team']['full_name'] if row['home_team']['id'] == team_id else row['home_team']['full_name'], axis=1)
-        df_team['opponentTeamConference'] = df_team.apply(lambda row: row['visitor_team']['conference'] if row['home_team']['id'] == team_id else row['home_team']['conference'], axis=1)
+        self._flatten(df_team, 'home_team', ['id', 'full_name', 'conference'])
+        self._flatten(df_team, 'visitor_team', ['full_name', 'conference'])
 
-        df_team['isHomeGame'] = df_team.apply(lambda row: row['home_team']['id'] == team_id, axis=1)
-        
-        df_team['result'] = df_team.apply(lambda row: ('Win' if (row['isHomeGame'] and row['homeTeamScore'] > row['visitorTeamScore']) or 
-                                      (not row['isHomeGame'] and row['visitorTeamScore'] > row['homeTeamScore'])
-                                      else 'Loss') if row['status'] == 'Final' else None, axis=1)
+        df_team['isHomeGame'] = df_team['home_team.id'] == team_id
+
+        is_home = df_team['isHomeGame'].to_numpy()
+        df_team['opponentTeam'] = np.where(is_home, df_team['visitor_team.full_name'], df_team['home_team.full_name'])
+        df_team['opponentTeamConference'] = np.where(is_home, df_team['visitor_team.conference'], df_team['home_team.conference'])
 
-        df_team['cumulativeWins'] = (df_team['result'] == 'Win').cumsum()
-        df_team['cumulativeLosses'] = (df_team['result'] == 'Loss').cumsum()
+        is_win = np.where(is_home, df_team['homeTeamScore'] > df_team['visitorTeamScore'], df_team['visitorTeamScore'] > df_team['homeTeamScore'])
+        df_team['result'] = np.where(df_team['status'] == 'Final', np.where(is_win, 'Win', 'Loss'), None)
 
-        df_final = df_team[['id', 'date', 'season', 'postseason', 'opponentTeam', 'status', 'opponentTeamConference', 'isHomeGame',  'totalPoints', 'homeTeamScore', 'visitorTeamScore', 'result', 'cumulativeWins', 'cumulativeLosses']]
+        columns = ['id', 'date', 'season', 'postseason', 'opponentTeam', 'status', 'opponentTeamConference', 'isHomeGame',  'totalPoints', 'homeTeamScore', 'visitorTeamScore', 'result']
+        if not self.derive_in_db and not self.partial_season:
+            df_team['cumulativeWins'] = (df_team['result'] == 'Win').cumsum()
+            df_team['cumulativeLosses'] = (df_team['result'] == 'Loss').cumsum()
+            columns += ['cumulativeWins', 'cumulativeLosses']
+
+        df_final = apply_schema(df_team[columns], "games")
         self.logger.info(f"Transformed games data. Size: {len(df_final)}")
         return df_final
     
@@ -73,55 +136,23 @@ class TransformBalldontlie:
         if not self.players_stats_data or len(self.players_stats_data) == 0:
             return DataFrame()
         
-        df_team_players_performance = DataFrame(self.players_stats_data)
-        df_team_players_performance.rename(columns={
-            'min': 'minutesPlayed',
-            'fgm': 'fieldGoalsMade',
-            'fga': 'fieldGoalsAttempted',
-            'fg3m': 'threePointsFieldGoalsMade',
-            'fg3a': 'threePointsFieldGoalsAttempted',
-            'ftm': 'freeThrowsMade',
-            'fta': 'freeThrowsAttempted',
-            'oreb': 'offensiveRebounds',
-            'dreb': 'defensiveRebounds',
-            'reb': 'rebounds',
-            'ast': 'assists',
-            'stl': 'steals',
-            'blk': 'blocks',
-            'pf': 'personalFouls',
-            'pts': 'points'
-        }, inplace=True)
-
-        # Calculate percentages
-        df_team_players_performance['fieldGoalPercentage'] = df_team_players_performance.apply(
-            lambda row: row['fieldGoalsMade'] / row['fieldGoalsAttempted'] if row['fieldGoalsAttempted'] > 0 else 0,
-            axis=1
+        df_team_players_performance = self.players_stats_frame().copy(deep=False)
+
+        # Calculate percentages, a player without attempts gets 0
+        df_team_players_performance['fieldGoalPercentage'] = self._percentage(
+            df_team_players_performance['fieldGoalsMade'], df_team_players_performance['fieldGoalsAttempted']
         )
-        df_team_players_performance['threePointsFieldGoalPercentage'] = df_team_players_performance.apply(
-            lambda row: row['threePointsFieldGoalsMade'] / row['threePointsFieldGoalsAttempted'] if row['threePointsFieldGoalsAttempted'] > 0 else 0,
-            axis=1
+        df_team_players_performance['threePointsFieldGoalPercentage'] = self._percentage(
+            df_team_players_performance['threePointsFieldGoalsMade'], df_team_players_performance['threePointsFieldGoalsAttempted']
         )
-        df_team_players_performance['freeThrowsPercentage'] = df_team_players_performance.apply(
-            lambda row: row['freeThrowsMade'] / row['freeThrowsAttempted'] if row['freeThrowsAttempted'] > 0 else 0,
-            axis=1
+        df_team_players_performance['freeThrowsPercentage'] = self._percentage(
+            df_team_players_performance['freeThrowsMade'], df_team_players_performance['freeThrowsAttempted']
         )
-        def classify_performance(percentage):
-            if percentage < 0.3:
-                return 'bad'
-            elif 0.3 <= percentage <= 0.5:
-                return 'ok'
-            else:
-                return 'good'
 
         # Apply performance categorization
-        df_team_players_performance['fieldGoalPerformance'] = df_team_players_performance['fieldGoalPercentage'].apply(classify_performance)
-        df_team_players_performance['threePointsFieldGoalPerformance'] = df_team_players_performance['threePointsFieldGoalPercentage'].apply(classify_performance)
-        df_team_players_performance['freeThrowsPerformance'] = df_team_players_performance['freeThrowsPercentage'].apply(classify_performance)
-
-        # Extract nested data for player, team, and game
-        df_team_players_performance['playerId'] = df_team_players_performance['player'].apply(lambda x: x['id'])
-        df_team_players_performance['teamId'] = df_team_players_performance['team'].apply(lambda x: x['id'])
-        df_team_players_performance['gameId'] = df_team_players_performance['game'].apply(lambda x: x['id'])
+        df_team_players_performance['fieldGoalPerformance'] = self._classify_performance(df_team_players_performance['fieldGoalPercentage'])
+        df_team_players_performance['threePointsFieldGoalPerformance'] = self._classify_performance(df_team_players_performance['threePointsFieldGoalPercentage'])
+        df_team_players_performance['freeThrowsPerformance'] = self._classify_performance(df_team_players_performance['freeThrowsPercentage'])
 
         columns_to_keep = ['id', 'gameId', 'playerId', 'teamId', 'minutesPlayed', 'fieldGoalsMade', 
                    'fieldGoalsAttempted', 'fieldGoalPercentage', 'fieldGoalPerformance', 
@@ -131,7 +162,7 @@ class TransformBalldontlie:
                    'freeThrowsPerformance', 'offensiveRebounds', 'defensiveRebounds', 
                    'rebounds', 'assists', 'steals', 'blocks', 'personalFouls', 'points']
         
-        df_final = df_team_players_performance[columns_to_keep]
+        df_final = apply_schema(df_team_players_performance[columns_to_keep], "players_performance")
         self.logger.info(f"Transformed players performance data. Size: {len(df_final)}")
         return df_final
     
@@ -139,36 +170,111 @@ class TransformBalldontlie:
         if not self.players_stats_data or len(self.players_stats_data) == 0:
             return DataFrame()
         
-        df_team_players_performance = json_normalize(self.players_stats_data)
-        df_team_players_performance['min'] = to_numeric(df_team_players_performance['min'], errors='coerce')
+        performance_stats = self.overall_performance_from_totals(self.team_players_totals())
+        self.logger.info(f"Transformed players overall performance data. Size: {len(performance_stats)}")
+        return performance_stats
+    
+    @staticmethod
+    def _frame(data, columns: list[str] = None):
+        # Record stores are already columnar with nested fields as dotted columns, which `_flatten` leaves as they are
+        if isinstance(data, RecordStore):
+            return DataFrame(data.columns(columns))
+        return DataFrame(data, columns=columns)
+    
+    @staticmethod
+    def _flatten(df: DataFrame, column: str, fields: list[str]):
+        # Adds `column.field` columns for the nested dicts of `column`, like json_normalize but only for the requested fields
+        missing_fields = [field for field in fields if f"{column}.{field}" not in df.columns]
+        if len(missing_fields) == 0:
+            return
         
-        df_team_players_performance.rename(columns={'player.id': 'playerId'}, inplace=True)
-
-        grouped = df_team_players_performance.groupby('playerId')
+        nested = DataFrame.from_records(
+            [value if isinstance(value, dict) else {} for value in df[column]], columns=missing_fields, index=df.index
+        )
+        for field in missing_fields:
+            df[f"{column}.{field}"] = nested[field]
+    
+    @staticmethod
+    def _percentage(made, attempted):
+        made = made.to_numpy(dtype='float64', na_value=np.nan)
+        attempted = attempted.to_numpy(dtype='float64', na_value=np.nan)
+        return np.where(attempted > 0, made / np.where(attempted > 0, attempted, np.nan), 0)
+    
+    @staticmethod
+    def _classify_performance(percentage):
+        # Below 0.3 is bad, up to 0.5 (inclusive) is ok, anything else is good
+        codes = np.select([percentage < 0.3, percentage <= 0.5], [0, 1], default=2)
+        return Categorical.from_codes(codes, dtype=PERFORMANCE)
+    
+    def players_stats_frame(self):
+        # Normalized once and shared by the per-game and per-player outputs, the largest input is only parsed once
+        if self._players_stats_frame is not None:
+            return self._players_stats_frame
+        
+        # Only the fields that end up in an output are materialized
+        if isinstance(self.players_stats_data, RecordStore):
+            df_stats = self._frame(self.players_stats_data, list(STATS_COLUMNS))
+        else:
+            raw_columns = [column for column in STATS_COLUMNS if '.' not in column] + ['player', 'team', 'game']
+            df_stats = DataFrame(self.players_stats_data, columns=raw_columns)
+            for column in ['player', 'team', 'game']:
+                self._flatten(df_stats, column, ['id'])
+        
+        df_stats = df_stats[list(STATS_COLUMNS)].rename(columns=STATS_COLUMNS)
+        df_stats['minutesPlayed'] = to_numeric(df_stats['minutesPlayed'], errors='coerce')
+        df_stats = apply_schema(df_stats, "players_performance")
+        
+        self.logger.info(f"Normalized players stats data. Size: {len(df_stats)}. Memory: {df_stats.memory_usage(deep=True).sum() / 1024 ** 2:.1f} MB")
+        self._players_stats_frame = df_stats
+        return df_stats
+    
+    def team_players_totals(self):
+        # Additive per-player totals, so totals of separate batches can be summed before deriving averages
+        if not self.players_stats_data or len(self.players_stats_data) == 0:
+            return DataFrame()
         
-        performance_stats = grouped.agg(
-            totalMinutesPlayed=('min', 'sum'),
-            averageMinutesPlayedPerGame=('min', 'mean'),
-            totalFieldGoalsAttempted=('fga', 'sum'),
-            totalFieldGoalsMade=('fgm', 'sum'),
-            totalThreePointsAttempted=('fg3a', 'sum'),
-            totalThreePointsMade=('fg3m', 'sum'),
-            totalFreeThrowsAttempted=('fta', 'sum'),
-            totalFreeThrowsMade=('ftm', 'sum'),
-            totalAssists=('ast', 'sum'),
-            totalPoints=('pts', 'sum'),
+        grouped = self.players_stats_frame().groupby('playerId')
+        
+        return grouped.agg(
+            totalMinutesPlayed=('minutesPlayed', 'sum'),
+            gamesPlayed=('minutesPlayed', 'count'),
+            totalFieldGoalsAttempted=('fieldGoalsAttempted', 'sum'),
+            totalFieldGoalsMade=('fieldGoalsMade', 'sum'),
+            totalThreePointsAttempted=('threePointsFieldGoalsAttempted', 'sum'),
+            totalThreePointsMade=('threePointsFieldGoalsMade', 'sum'),
+            totalFreeThrowsAttempted=('freeThrowsAttempted', 'sum'),
+            totalFreeThrowsMade=('freeThrowsMade', 'sum'),
+            totalAssists=('assists', 'sum'),
+            totalPoints=('points', 'sum'),
+        )
+    
+    @staticmethod
+    def merge_players_totals(totals: DataFrame, batch_totals: DataFrame):
+        if len(totals) == 0:
+            return batch_totals
+        if len(batch_totals) == 0:
+            return totals
+        return concat([totals, batch_totals]).groupby(level=0).sum()
+    
+    @staticmethod
+    def overall_performance_from_totals(totals: DataFrame):
+        if len(totals) == 0:
+            return DataFrame()
+        
+        performance_stats = totals.astype('float64')
+        performance_stats.insert(
+            2, 'averageMinutesPlayedPerGame', performance_stats['totalMinutesPlayed'] / performance_stats['gamesPlayed']
         )
 
         performance_stats['fieldGoalPercentage'] = performance_stats['totalFieldGoalsMade'] / performance_stats['totalFieldGoalsAttempted']
         performance_stats['threePointsPercentage'] = performance_stats['totalThreePointsMade'] / performance_stats['totalThreePointsAttempted']
         performance_stats['freeThrowsPercentage'] = performance_stats['totalFreeThrowsMade'] / performance_stats['totalFreeThrowsAttempted']
 
-        performance_stats['fieldGoalPercentage'].fillna(0, inplace=True)
-        performance_stats['threePointsPercentage'].fillna(0, inplace=True)
-        performance_stats['freeThrowsPercentage'].fillna(0, inplace=True)
+        performance_stats['fieldGoalPercentage'] = performance_stats['fieldGoalPercentage'].fillna(0)
+        performance_stats['threePointsPercentage'] = performance_stats['threePointsPercentage'].fillna(0)
+        performance_stats['freeThrowsPercentage'] = performance_stats['freeThrowsPercentage'].fillna(0)
         
         performance_stats.reset_index(inplace=True)
 
         performance_stats.rename(columns={'playerId': 'id'}, inplace=True)
-        self.logger.info(f"Transformed players overall performance data. Size: {len(performance_stats)}")
-        return performance_stats
\ No newline at end of file
+        return apply_schema(performance_stats, "players_overall_performance")
@@ -0,0 +1,161 @@
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from dotenv import load_dotenv
+from jinja2 import Environment, FileSystemLoader
+from etl.assets.extractors.extract_balldontlie import ExtractBalldontlie
+from etl.assets.tranformers.transform_balldontlie import TransformBalldontlie
+from etl.benchmarks.fake_api import FakeBalldontlieServer, FakeLeague
+from etl.connectors.http_client import HttpClient
+from etl.connectors.metrics import get_metrics
+from etl.connectors.postgresql import PostgreSqlClient
+from etl.connectors.rate_limiter import RateLimiter
+from etl.pipelines.balldontlie import run_batch
+
+# (teams in the league, seasons, teams extracted per season)
+SCALES = {
+    "one_team": (30, [2023], 1),
+    "league": (30, [2023], 30),
+    "multi_season": (30, [2021, 2022, 2023], 30),
+}
+
+SQL_TEMPLATES_PATH = Path(__file__).resolve().parents[1] / "assets" / "sql"
+
+def get_sql_client(logger, pool_size: int):
+    # A dedicated database, benchmark runs drop and rewrite their tables
+    server_name = os.environ.get("BENCHMARK_DB_SERVER_NAME")
+    if not server_name:
+        return None
+
+    return PostgreSqlClient(
+        logger=logger,
+        server_name=server_name,
+        database_name=os.environ.get("BENCHMARK_DB_NAME"),
+        username=os.environ.get("BENCHMARK_DB_USERNAME"),
+        password=os.environ.get("BENCHMARK_DB_PASSWORD"),
+        port=os.environ.get("BENCHMARK_DB_PORT", 5432),
+        pool_size=pool_size,
+    )
+
+def extract_and_transform(logger, http_client, api_url: str, stats_date_shards: int, team_id: int, season: str) -> dict:
+    # Used when no database is configured, the load stage is skipped
+    extractor = ExtractBalldontlie(
+        sql_client=None,
+        logger=logger,
+        api_key="benchmark",
+        api_url=api_url,
+        team_id=team_id,
+        season=season,
+        mode="full",
+        http_client=http_client,
+        stats_date_shards=stats_date_shards,
+    )
+    team, team_players, team_games, players_stats = extractor.extract()
+    transformer = TransformBalldontlie(logger, team, team_players, team_games, players_stats)
+    df_players_performance = transformer.transform()[3]
+    return {"team_id": team_id, "season": season, "status": "success", "rows": {"players_performance": len(df_players_performance)}}
+
+def run(scale: str, latency: float, error_rate: float, max_workers: int, load_method: str, streaming: bool, stats_date_shards: int = 1, layout: str = "per_team", derive_in_db: bool = False) -> dict:
+    team_count, seasons, extracted_teams = SCALES[scale]
+    logger = logging.getLogger("benchmark")
+
+    league = FakeLeague(team_count=team_count, seasons=seasons)
+    targets = [(team_id, str(season)) for season in seasons for team_id in range(1, extracted_teams + 1)]
+
+    sql_client = get_sql_client(logger, pool_size=max_workers * 5)
+    http_client = HttpClient(pool_size=max_workers * 4, rate_limiter=RateLimiter(requests_per_minute=10 ** 7))
+
+    with FakeBalldontlieServer(league, latency=latency, error_rate=error_rate) as server:
+        started_at = time.perf_counter()
+        if sql_client:
+            results = run_batch(
+                logger=logger,
+                targets=targets,
+                max_workers=max_workers,
+                sql_client=sql_client,
+                http_client=http_client,
+                tables_template=Environment(loader=FileSystemLoader(str(SQL_TEMPLATES_PATH))),
+                api_key="benchmark",
+                api_url=server.url,
+                mode="full",
+                streaming=streaming,
+                load_method=load_method,
+                stats_date_shards=stats_date_shards,
+                layout=layout,
+                derive_in_db=derive_in_db,
+            )
+        else:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                results = list(executor.map(lambda target: extract_and_transform(logger, http_client, server.url, stats_date_shards, *target), targets))
+        wall_seconds = time.perf_counter() - started_at
+
+    report = get_metrics().report()
+    stats_rows = sum(result["rows"]["players_performance"] for result in results if result["status"] == "success")
+    stages = {}
+    for timer in report["timers"]:
+        if timer["name"] in ("extract", "transform", "load"):
+            stage = stages.setdefault(timer["name"], {"wall_seconds": 0.0, "cpu_seconds": 0.0})
+            stage["wall_seconds"] += timer["wall_seconds"]
+            stage["cpu_seconds"] += timer["cpu_seconds"]
+
+    return {
+        "scale": scale,
+        "dataset": league.size(),
+        "targets": len(targets),
+        "failed": len([result for result in results if result["status"] != "success"]),
+        "loaded": sql_client is not None,
+        "wall_seconds": round(wall_seconds, 3),
+        "stats_rows": stats_rows,
+        "stats_per_second": round(stats_rows / wall_seconds, 1),
+        "http_requests": server.requests,
+        "http_429": server.rate_limited,
+        "upserted_rows": sum(counter["value"] for counter in report["counters"] if counter["name"] == "upsert_rows"),
+        "stages": stages,
+        "peak_rss_mb": round(report["peak_rss_bytes"] / 1024 ** 2, 1) if report["peak_rss_bytes"] else None,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the balldontlie pipeline end to end against a local fake API")
+    parser.add_argument("--scales", nargs="+", choices=list(SCALES), default=list(SCALES))
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds added to every fake API response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of fake API requests answered with a 429")
+    parser.add_argument("--max-workers", type=int, default=4)
+    parser.add_argument("--load-method", default="copy", choices=["copy", "values"])
+    parser.add_argument("--streaming", action="store_true")
+    parser.add_argument("--stats-date-shards", type=int, default=1, help="date ranges each player chunk of /stats is split into")
+    parser.add_argument("--layout", default="per_team", choices=["per_team", "partitioned"])
+    parser.add_argument("--derive-in-db", action="store_true", help="derive the overall performance and cumulative record as materialized views")
+    parser.add_argument("--in-process", action="store_true", help="run the scales in this process instead of one subprocess each")
+    args = parser.parse_args()
+
+    load_dotenv()
+    options = {
+        "latency": args.latency,
+        "error_rate": args.error_rate,
+        "max_workers": args.max_workers,
+        "load_method": args.load_method,
+        "streaming": args.streaming,
+        "stats_date_shards": args.stats_date_shards,
+        "layout": args.layout,
+        "derive_in_db": args.derive_in_db,
+    }
+
+    for scale in args.scales:
+        if args.in_process:
+            print(json.dumps(run(scale, **options)))
+            continue
+
+        # Each scale runs in a fresh interpreter so its peak RSS is not inherited from the previous one
+        command = [sys.executable, "-m", "etl.benchmarks.end_to_end", "--in-process", "--scales", scale]
+        command += ["--latency", str(args.latency), "--error-rate", str(args.error_rate), "--max-workers", str(args.max_workers), "--load-method", args.load_method, "--stats-date-shards", str(args.stats_date_shards), "--layout", args.layout]
+        if args.streaming:
+            command.append("--streaming")
+        if args.derive_in_db:
+            command.append("--derive-in-db")
+        subprocess.run(command, check=True)
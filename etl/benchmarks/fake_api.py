@@ -0,0 +1,189 @@
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from etl.benchmarks import synthetic
+
+MAX_PER_PAGE = 100
+
+class FakeLeague:
+    # Deterministic league: every team plays `games_per_team` games per season and
+    # `players_per_game` players of each side get a stats line per game
+    def __init__(self, team_count: int = 30, seasons: list[int] = None, players_per_team: int = 15, games_per_team: int = 82, players_per_game: int = 10, seed: int = 0):
+        self.teams = synthetic.teams(team_count)
+        self.seasons = seasons or [2023]
+        rng = random.Random(seed)
+
+        self.players = {}
+        for team in self.teams:
+            first_id = (team["id"] - 1) * players_per_team + 1
+            self.players[team["id"]] = synthetic.players(players_per_team, team_id=team["id"], first_id=first_id, rng=rng)
+
+        self.games = {}
+        self.stats = {}
+        self.stats_by_game = {}
+        game_id, stat_id = 1, 1
+        for season in self.seasons:
+            season_games = []
+            for _ in range(team_count * games_per_team // 2):
+                home_team, visitor_team = rng.sample(self.teams, 2) if team_count > 1 else (self.teams[0], synthetic.team(team_count + 1))
+                game = synthetic.games(1, team_id=home_team["id"], season=season, first_id=game_id, team_count=team_count, rng=rng)[0]
+                game["home_team"], game["visitor_team"] = home_team, visitor_team
+                season_games.append(game)
+                game_id += 1
+
+            season_stats = []
+            for game in season_games:
+                for team in (game["home_team"], game["visitor_team"]):
+                    roster = self.players.get(team["id"], [])
+                    for player in rng.sample(roster, min(players_per_game, len(roster))):
+                        season_stats.extend(synthetic.stats(1, [player], [game], first_id=stat_id, rng=rng))
+                        stat_id += 1
+
+            self.games[season] = season_games
+            self.stats[season] = {}
+            for stat in season_stats:
+                self.stats[season].setdefault(stat["player"]["id"], []).append(stat)
+                self.stats_by_game.setdefault(stat["game"]["id"], []).append(stat)
+
+    def team(self, team_id: int):
+        return next((team for team in self.teams if team["id"] == team_id), None)
+
+    def active_players(self, team_ids: set) -> list[dict]:
+        return [player for team_id in sorted(team_ids) for player in self.players.get(team_id, [])]
+
+    def team_games(self, team_ids: set, seasons: set, start_date: str = None, end_date: str = None) -> list[dict]:
+        return [
+            game for season in self.seasons if not seasons or season in seasons for game in self.games[season]
+            if (game["home_team"]["id"] in team_ids or game["visitor_team"]["id"] in team_ids)
+            and (not start_date or game["date"] >= start_date) and (not end_date or game["date"] <= end_date)
+        ]
+
+    def game_stats(self, game_ids: set) -> list[dict]:
+        return [stat for game_id in game_ids for stat in self.stats_by_game.get(game_id, [])]
+
+    def player_stats(self, player_ids: set, seasons: set, start_date: str = None, end_date: str = None) -> list[dict]:
+        return [
+            stat for season in self.seasons if not seasons or season in seasons
+            for player_id in player_ids for stat in self.stats[season].get(player_id, [])
+            if (not start_date or stat["game"]["date"] >= start_date) and (not end_date or stat["game"]["date"] <= end_date)
+        ]
+
+    def size(self) -> dict:
+        return {
+            "teams": len(self.teams),
+            "seasons": len(self.seasons),
+            "players": sum(len(players) for players in self.players.values()),
+            "games": sum(len(games) for games in self.games.values()),
+            "stats": sum(len(stats) for players_stats in self.stats.values() for stats in players_stats.values()),
+        }
+
+class FakeBalldontlieServer:
+    # Serves a FakeLeague with the balldontlie cursor pagination on a local port.
+    # `latency` is added to every response and `error_rate` of the requests get a 429.
+    def __init__(self, league: FakeLeague, latency: float = 0.0, error_rate: float = 0.0, retry_after: int = 0, seed: int = 0):
+        self.league = league
+        self.latency = latency
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.rate_limited = 0
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def respond(self, path: str, query: dict):
+        # Returns (status, body)
+        with self.lock:
+            self.requests += 1
+            is_rate_limited = self.error_rate > 0 and self.rng.random() < self.error_rate
+            if is_rate_limited:
+                self.rate_limited += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if is_rate_limited:
+            return 429, {"error": "Too Many Requests"}
+
+        team_match = re.fullmatch(r"/teams/(\d+)", path)
+        if team_match:
+            team = self.league.team(int(team_match.group(1)))
+            return (200, {"data": team}) if team else (404, {"error": "Not Found"})
+
+        seasons = {int(season) for season in self._values(query, "seasons[]")}
+        start_date, end_date = (query.get("start_date") or [None])[0], (query.get("end_date") or [None])[0]
+        if path == "/players/active":
+            records = self.league.active_players({int(team_id) for team_id in self._values(query, "team_ids[]")})
+        elif path == "/games":
+            records = self.league.team_games({int(team_id) for team_id in self._values(query, "team_ids[]")}, seasons, start_date, end_date)
+        elif path == "/stats" and "game_ids[]" in query:
+            records = self.league.game_stats({int(game_id) for game_id in self._values(query, "game_ids[]")})
+        elif path == "/stats":
+            player_ids = {int(player_id) for player_id in self._values(query, "player_ids[]")}
+            records = self.league.player_stats(player_ids, seasons, start_date, end_date)
+        else:
+            return 404, {"error": "Not Found"}
+
+        return 200, self._page(records, query)
+
+    def _page(self, records: list[dict], query: dict) -> dict:
+        # Cursors are the id of the last record of the previous page
+        cursor = int((query.get("cursor") or [0])[0])
+        per_page = min(int((query.get("per_page") or [25])[0]), MAX_PER_PAGE)
+        remaining = sorted((record for record in records if record["id"] > cursor), key=lambda record: record["id"])
+        page = remaining[:per_page]
+        meta = {"per_page": per_page}
+        if len(remaining) > per_page:
+            meta["next_cursor"] = page[-1]["id"]
+        return {"data": page, "meta": meta}
+
+    def _values(self, query: dict, name: str) -> list[str]:
+        # Parameter names are matched exactly like the real API does, a malformed name is ignored
+        return query.get(name, [])
+
+    def _handler(self):
+        fake_server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                # An API URL with a trailing slash produces paths like //teams/1
+                status, body = fake_server.respond(re.sub(r"/+", "/", url.path).rstrip("/"), parse_qs(url.query))
+                content = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(content)))
+                if status == 429:
+                    self.send_header("Retry-After", str(fake_server.retry_after))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
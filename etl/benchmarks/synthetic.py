@@ -0,0 +1,103 @@
+import random
+
+CONFERENCES = ["East", "West"]
+POSITIONS = ["G", "F", "C", "G-F", "F-C", ""]
+STATUSES = ["Final", "Final", "Final", "Final", "1st Qtr", "2024-04-01T23:00:00Z"]
+
+def team(team_id: int) -> dict:
+    return {
+        "id": team_id,
+        "conference": CONFERENCES[team_id % 2],
+        "division": f"Division {team_id % 6}",
+        "city": f"City {team_id}",
+        "name": f"Team{team_id}",
+        "full_name": f"City {team_id} Team{team_id}",
+        "abbreviation": f"T{team_id:02d}",
+    }
+
+def teams(count: int = 30) -> list[dict]:
+    return [team(team_id) for team_id in range(1, count + 1)]
+
+def players(count: int, team_id: int = 1, first_id: int = 1, rng: random.Random = None) -> list[dict]:
+    rng = rng or random.Random(0)
+    player_team = team(team_id)
+    return [
+        {
+            "id": player_id,
+            "first_name": f"First{player_id}",
+            "last_name": f"Last{player_id}",
+            "position": rng.choice(POSITIONS),
+            "height": f"6-{rng.randint(0, 11)}",
+            "weight": str(rng.randint(170, 280)),
+            "jersey_number": str(rng.randint(0, 99)),
+            "college": "College",
+            "country": "USA",
+            "draft_year": rng.choice([None, rng.randint(2005, 2023)]),
+            "draft_round": 1,
+            "draft_number": rng.randint(1, 60),
+            "team": player_team,
+        }
+        for player_id in range(first_id, first_id + count)
+    ]
+
+def games(count: int, team_id: int = 1, season: int = 2023, first_id: int = 1, team_count: int = 30, rng: random.Random = None) -> list[dict]:
+    rng = rng or random.Random(0)
+    own_team = team(team_id)
+    opponents = [team(opponent_id) for opponent_id in range(1, team_count + 1) if opponent_id != team_id]
+    records = []
+    for game_id in range(first_id, first_id + count):
+        opponent = rng.choice(opponents)
+        is_home = rng.random() < 0.5
+        records.append({
+            "id": game_id,
+            "date": f"{season + 1}-0{1 + game_id % 4}-{1 + game_id % 28:02d}",
+            "season": season,
+            "status": rng.choice(STATUSES),
+            "period": 4,
+            "time": "Final",
+            "postseason": False,
+            "home_team_score": rng.randint(80, 140),
+            "visitor_team_score": rng.randint(80, 140),
+            "home_team": own_team if is_home else opponent,
+            "visitor_team": opponent if is_home else own_team,
+        })
+    return records
+
+def stats(count: int, players_data: list[dict], games_data: list[dict], first_id: int = 1, rng: random.Random = None) -> list[dict]:
+    # Nested player/team/game dicts are shared between rows, like a decoded page would hold equal values
+    rng = rng or random.Random(0)
+    stat_players = [
+        {"id": player["id"], "first_name": player["first_name"], "last_name": player["last_name"], "position": player["position"], "team_id": player["team"]["id"]}
+        for player in players_data
+    ]
+    stat_games = [
+        {
+            "id": game["id"], "date": game["date"], "season": game["season"], "status": game["status"],
+            "home_team_id": game["home_team"]["id"], "visitor_team_id": game["visitor_team"]["id"],
+            "home_team_score": game["home_team_score"], "visitor_team_score": game["visitor_team_score"],
+        }
+        for game in games_data
+    ]
+    stat_teams = {player["team"]["id"]: player["team"] for player in players_data}
+
+    records = []
+    for stat_id in range(first_id, first_id + count):
+        player = rng.choice(stat_players)
+        fga, fg3a, fta = rng.randint(0, 25), rng.randint(0, 12), rng.randint(0, 12)
+        fgm, fg3m, ftm = rng.randint(0, fga), rng.randint(0, fg3a), rng.randint(0, fta)
+        oreb, dreb = rng.randint(0, 5), rng.randint(0, 10)
+        records.append({
+            "id": stat_id,
+            "min": rng.choice([str(rng.randint(1, 48)), "00", "", None]),
+            "fgm": fgm, "fga": fga, "fg_pct": fgm / fga if fga else 0,
+            "fg3m": fg3m, "fg3a": fg3a, "fg3_pct": fg3m / fg3a if fg3a else 0,
+            "ftm": ftm, "fta": fta, "ft_pct": ftm / fta if fta else 0,
+            "oreb": oreb, "dreb": dreb, "reb": oreb + dreb,
+            "ast": rng.randint(0, 12), "stl": rng.randint(0, 4), "blk": rng.randint(0, 4),
+            "turnover": rng.randint(0, 6), "pf": rng.randint(0, 6),
+            "pts": 2 * (fgm - fg3m) + 3 * fg3m + ftm,
+            "player": player,
+            "team": stat_teams[player["team_id"]],
+            "game": rng.choice(stat_games),
+        })
+    return records
@@ -0,0 +1,56 @@
+import argparse
+import json
+import logging
+import random
+import time
+import tracemalloc
+from etl.assets.tranformers.transform_balldontlie import TransformBalldontlie
+from etl.benchmarks import synthetic
+
+TRANSFORMS = ["team_players", "team_games", "team_players_performance", "team_players_overall_performance"]
+
+def run(rows: int, repeat: int, memory: bool = False) -> dict:
+    rng = random.Random(rows)
+    players_data = synthetic.players(max(15, rows // 1000), rng=rng)
+    games_data = synthetic.games(max(82, rows // 10), rng=rng)
+    stats_data = synthetic.stats(rows, players_data, games_data, rng=rng)
+
+    logger = logging.getLogger("benchmark")
+    transformer = TransformBalldontlie(logger, synthetic.team(1), players_data, games_data, stats_data)
+
+    timings = {}
+    for transform in TRANSFORMS:
+        method = getattr(transformer, transform)
+        args = [1] if transform == "team_games" else []
+        best = None
+        for _ in range(repeat):
+            started_at = time.perf_counter()
+            method(*args)
+            elapsed = time.perf_counter() - started_at
+            best = elapsed if best is None else min(best, elapsed)
+        timings[transform] = round(best, 4)
+
+    result = {"rows": rows, "games": len(games_data), "players": len(players_data), "seconds": timings}
+    if memory:
+        result["peak_mb"] = stats_peak_memory(logger, players_data, games_data, stats_data)
+    return result
+
+def stats_peak_memory(logger, players_data, games_data, stats_data) -> float:
+    # Peak memory of building both stats outputs from the same input, on a fresh transformer
+    transformer = TransformBalldontlie(logger, synthetic.team(1), players_data, games_data, stats_data)
+    tracemalloc.start()
+    transformer.team_players_performance()
+    transformer.team_players_overall_performance()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return round(peak / 1024 ** 2, 1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time TransformBalldontlie on synthetic stats")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--memory", action="store_true", help="also report peak memory of the stats transforms")
+    args = parser.parse_args()
+
+    for rows in args.rows:
+        print(json.dumps(run(rows, args.repeat, args.memory)))
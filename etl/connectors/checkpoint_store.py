@@ -0,0 +1,34 @@
+import json
+import os
+import threading
+
+class CheckpointStore:
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.checkpoints = {}
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        if os.path.exists(path):
+            with open(path) as checkpoint_file:
+                self.checkpoints = json.load(checkpoint_file)
+
+    def get(self, key: str, default=None):
+        with self.lock:
+            return self.checkpoints.get(key, default)
+
+    def save(self, cursors: dict) -> None:
+        # Only called once the pages behind the cursors are committed to the database
+        if len(cursors) == 0:
+            return
+
+        with self.lock:
+            self.checkpoints.update(cursors)
+            # Written to a temporary file and renamed so a crash never leaves a truncated checkpoint
+            temporary_path = f"{self.path}.tmp"
+            with open(temporary_path, "w") as checkpoint_file:
+                json.dump(self.checkpoints, checkpoint_file, indent=2, sort_keys=True)
+            os.replace(temporary_path, self.path)
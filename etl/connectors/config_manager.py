@@ -1,11 +1,143 @@
-import boto3
-from botocore.exceptions import ClientError
+import json
+import os
+import threading
+import time
+
+# SSM GetParameters accepts at most 10 names per call
+MAX_NAMES_PER_CALL = 10
+
+class LocalParameterStore:
+    # Stands in for the SSM client in tests and local runs, parameters come from a dict or a JSON file of name -> value
+    def __init__(self, parameters: dict = None, path: str = None):
+        self.parameters = dict(parameters or {})
+        if path:
+            with open(path) as parameters_file:
+                self.parameters.update(json.load(parameters_file))
+        self.calls = 0
+
+    def get_parameters(self, Names, WithDecryption=False):
+        self.calls += 1
+        return {
+            "Parameters": [{"Name": name, "Value": str(self.parameters[name])} for name in Names if name in self.parameters],
+            "InvalidParameters": [name for name in Names if name not in self.parameters],
+        }
+
+    def get_parameters_by_path(self, Path, WithDecryption=False, Recursive=False, NextToken=None):
+        self.calls += 1
+        prefix = Path.rstrip("/") + "/"
+        return {
+            "Parameters": [
+                {"Name": name, "Value": str(value)} for name, value in self.parameters.items()
+                if name.startswith(prefix) and (Recursive or "/" not in name[len(prefix):])
+            ]
+        }
+
+class ConfigManager:
+    # Resolves SSM parameters with one shared client and batched calls. Resolved values are kept in a local
+    # JSON file for `ttl_seconds`, so repeated runs within the TTL make no SSM call at all.
+    def __init__(self, client=None, region_name: str = 'us-east-1', cache_path: str = None, ttl_seconds: int = 900, path: str = None):
+        self.client = client
+        self.region_name = region_name
+        self.cache_path = cache_path
+        self.ttl_seconds = ttl_seconds
+        # With a path, every parameter under it is fetched at once and named relative to it
+        self.path = path.rstrip("/") if path else None
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def get_parameter(self, name: str):
+        return self.get_parameters([name]).get(name)
+
+    def get_parameters(self, names: list[str]) -> dict:
+        with self.lock:
+            now = time.time()
+            if len(self.values) == 0:
+                self.values = self._read_cache()
+            values = {name: self.values[name]["value"] for name in names if self.values.get(name, {}).get("expires_at", 0) > now}
+
+            missing = [name for name in names if name not in values]
+            if len(missing) > 0:
+                fetched = self._fetch(missing)
+                if fetched is None:
+                    # Failed calls are not cached, the next run asks again
+                    return dict(values, **{name: None for name in missing})
+                # Parameters that don't exist are cached too, so they are not requested again on every run
+                for name in [*missing, *fetched]:
+                    self.values[name] = {"value": fetched.get(name), "expires_at": now + self.ttl_seconds}
+                values.update({name: fetched.get(name) for name in missing})
+                self._write_cache()
+            return values
+
+    def _get_client(self):
+        if self.client is None:
+            import boto3
+            self.client = boto3.client('ssm', region_name=self.region_name)
+        return self.client
+
+    def _fetch(self, names: list[str]) -> dict:
+        from botocore.exceptions import ClientError
+
+        client = self._get_client()
+        values = {}
+        try:
+            if self.path:
+                kwargs = {"Path": self.path, "WithDecryption": True}
+                while True:
+                    response = client.get_parameters_by_path(**kwargs)
+                    for parameter in response["Parameters"]:
+                        values[parameter["Name"][len(self.path) + 1:]] = parameter["Value"]
+                    if not response.get("NextToken"):
+                        break
+                    kwargs["NextToken"] = response["NextToken"]
+                return values
+
+            for chunk in range(0, len(names), MAX_NAMES_PER_CALL):
+                response = client.get_parameters(Names=names[chunk:chunk + MAX_NAMES_PER_CALL], WithDecryption=True)
+                for parameter in response["Parameters"]:
+                    values[parameter["Name"]] = parameter["Value"]
+                for name in response.get("InvalidParameters", []):
+                    print(f"Parameter {name} not found")
+        except ClientError as e:
+            print(f"Error retrieving parameters {', '.join(names)}: {e}")
+            return None
+        return values
+
+    def _read_cache(self) -> dict:
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return {}
+        try:
+            with open(self.cache_path) as cache_file:
+                cache = json.load(cache_file)
+        except (OSError, ValueError):
+            return {}
+        # A cache written for another parameter path is ignored
+        return cache.get("parameters", {}) if cache.get("path") == self.path else {}
+
+    def _write_cache(self) -> None:
+        if not self.cache_path:
+            return
+
+        directory = os.path.dirname(self.cache_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # Values are decrypted, so the file is only readable by its owner
+        temporary_path = f"{self.cache_path}.tmp"
+        file_descriptor = os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(file_descriptor, "w") as cache_file:
+            json.dump({"path": self.path, "parameters": self.values}, cache_file, indent=2, sort_keys=True)
+        os.replace(temporary_path, self.cache_path)
+
+config_manager = None
+config_manager_lock = threading.Lock()
+
+def get_config_manager() -> ConfigManager:
+    # One client per process unless the caller configures its own
+    global config_manager
+    with config_manager_lock:
+        if config_manager is None:
+            config_manager = ConfigManager()
+        return config_manager
 
 def get_parameter(name):
-    ssm = boto3.client('ssm', region_name='us-east-1')
-    try:
-        response = ssm.get_parameter(Name=name, WithDecryption=True)
-        return response['Parameter']['Value']
-    except ClientError as e:
-        print(f"Error retrieving parameter {name}: {e}")
-        return None
+    return get_config_manager().get_parameter(name)
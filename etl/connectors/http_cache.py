@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import urlparse
+
+DEFAULT_TTLS = {
+    "/teams": 7 * 24 * 3600,
+    "/players": 24 * 3600,
+    "/games": 3600,
+    "/stats": 3600,
+}
+
+class HttpCache:
+    def __init__(self, path: str, ttls: dict = None, max_bytes: int = 512 * 1024 * 1024):
+        self.path = path
+        self.ttls = ttls or DEFAULT_TTLS
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                url TEXT,
+                body BLOB,
+                etag TEXT,
+                last_modified TEXT,
+                expires_at REAL,
+                accessed_at REAL,
+                size INTEGER
+            )
+            """
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+        self.connection.commit()
+
+    def key(self, url: str, params=None) -> str:
+        raw = json.dumps([url, params or {}], sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def get(self, key: str):
+        # Returns (body, etag, last_modified, is_fresh) or None
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT body, etag, last_modified, expires_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self.connection.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            self.connection.commit()
+
+        body, etag, last_modified, expires_at = row
+        is_fresh = expires_at is None or expires_at > time.time()
+        return body, etag, last_modified, is_fresh
+
+    def put(self, key: str, url: str, body: bytes, etag: str = None, last_modified: str = None) -> None:
+        expires_at = self._expires_at(url, body)
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, url, body, etag, last_modified, expires_at, time.time(), len(body)),
+            )
+            self._evict()
+            self.connection.commit()
+
+    def refresh(self, key: str, url: str, body: bytes) -> None:
+        # A 304 revalidation restarts the TTL of the stored body
+        with self.lock:
+            self.connection.execute(
+                "UPDATE responses SET expires_at = ?, accessed_at = ? WHERE key = ?",
+                (self._expires_at(url, body), time.time(), key),
+            )
+            self.connection.commit()
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def _expires_at(self, url: str, body: bytes):
+        # Full pages made only of final games never change again, so they are kept until evicted.
+        # The last page of a cursor chain still grows as games are played and keeps the endpoint TTL.
+        if self._is_final(body):
+            return None
+
+        path = urlparse(url).path
+        ttl = next((ttl for endpoint, ttl in self.ttls.items() if endpoint in path), 0)
+        return time.time() + ttl
+
+    def _is_final(self, body: bytes) -> bool:
+        try:
+            page = json.loads(body)
+            records, meta = page.get("data"), page.get("meta") or {}
+        except (ValueError, AttributeError):
+            return False
+        if not isinstance(records, list) or len(records) == 0:
+            return False
+        if not meta.get("next_cursor") or len(records) < (meta.get("per_page") or 0):
+            return False
+
+        for record in records:
+            game = record.get("game") if "game" in record else record
+            if not isinstance(game, dict) or game.get("status") != "Final":
+                return False
+        return True
+
+    def _evict(self) -> None:
+        total_size = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total_size <= self.max_bytes:
+            return
+
+        rows = self.connection.execute("SELECT key, size FROM responses ORDER BY accessed_at").fetchall()
+        evicted = []
+        for key, size in rows:
+            if total_size <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total_size -= size
+        self.connection.executemany("DELETE FROM responses WHERE key = ?", evicted)
@@ -0,0 +1,86 @@
+import re
+import time
+import requests
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from etl.connectors.rate_limiter import RateLimiter
+from etl.connectors.http_cache import HttpCache
+from etl.connectors.metrics import get_metrics
+
+class HttpClient:
+    def __init__(self, pool_size: int = 16, timeout: float = 30, rate_limiter: RateLimiter = None, cache: HttpCache = None):
+        self.timeout = timeout
+        self.session = requests.Session()
+        # Shared by every request of the process so concurrent fetches stay under the API quota
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.cache = cache
+
+        # Keep-alive connections are reused across pages and across threads
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def get(self, url: str, params=None, headers=None, revalidate: bool = False) -> requests.Response:
+        if not self.cache:
+            return self._send(url, params, headers)
+
+        key = self.cache.key(url, params)
+        cached = self.cache.get(key)
+        if cached:
+            body, etag, last_modified, is_fresh = cached
+            # Answers that have to be current always ask the server, a stored body is only reused on a 304
+            if is_fresh and not revalidate:
+                get_metrics().increment("http_cache_hits", endpoint=self._endpoint(url))
+                return self._cached_response(url, body)
+
+            headers = dict(headers or {})
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+
+        response = self._send(url, params, headers)
+
+        if response.status_code == 304 and cached:
+            get_metrics().increment("http_cache_revalidations", endpoint=self._endpoint(url))
+            self.cache.refresh(key, url, cached[0])
+            return self._cached_response(url, cached[0])
+
+        if response.status_code == 200:
+            self.cache.put(key, url, response.content, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+
+        return response
+
+    def close(self) -> None:
+        self.session.close()
+        if self.cache:
+            self.cache.close()
+
+    def _send(self, url: str, params=None, headers=None) -> requests.Response:
+        self.rate_limiter.acquire()
+        started_at = time.perf_counter()
+        response = self.session.get(url=url, params=params, headers=headers, timeout=self.timeout)
+
+        endpoint = self._endpoint(url)
+        get_metrics().observe("http_request_seconds", time.perf_counter() - started_at, endpoint=endpoint)
+        get_metrics().increment("http_requests", endpoint=endpoint, status=response.status_code)
+
+        if response.status_code == 429:
+            self.rate_limiter.penalize(response.headers.get("Retry-After"))
+        else:
+            self.rate_limiter.update_from_headers(response.headers)
+
+        return response
+
+    def _endpoint(self, url: str) -> str:
+        # Ids are collapsed so /teams/2 and /teams/3 share one series
+        return re.sub(r"/\d+", "/:id", urlparse(url).path.rstrip("/"))
+
+    def _cached_response(self, url: str, body: bytes) -> requests.Response:
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response._content = body
+        response.headers = CaseInsensitiveDict({"Content-Type": "application/json"})
+        return response
@@ -0,0 +1,59 @@
+import os
+import time
+from datetime import date
+from pathlib import Path
+from uuid import uuid4
+from etl.connectors.record_store import RecordStore
+
+class LandingZone:
+    # Raw API records as compressed Parquet, partitioned as
+    # <path>/<entity>/team_id=<id>/season=<season>/date=<extraction date>/part-<n>.parquet
+    def __init__(self, path: str, compression: str = "zstd"):
+        self.path = Path(path)
+        self.compression = compression
+
+    def write(self, entity: str, team_id, season, records) -> str:
+        if not records or len(records) == 0:
+            return None
+
+        # Imported on first use, runs without a landing zone never load pyarrow
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        partition = self._partition(entity, team_id, season) / f"date={date.today().isoformat()}"
+        os.makedirs(partition, exist_ok=True)
+
+        # Part names sort in write order, so later parts win when records are replayed
+        file_path = partition / f"part-{time.time_ns()}-{uuid4().hex[:8]}.parquet"
+        temporary_path = file_path.with_suffix(".tmp")
+        # Record stores are landed as they are held, nested fields as dotted columns
+        table = pa.Table.from_pydict(records.columns()) if isinstance(records, RecordStore) else pa.Table.from_pylist(records)
+        pq.write_table(table, temporary_path, compression=self.compression)
+        os.replace(temporary_path, file_path)
+        return str(file_path)
+
+    def read(self, entity: str, team_id, season, until_date: str = None, snapshot: bool = False) -> RecordStore:
+        # Every record of an entity, deduplicated by id keeping its latest extraction. Parts landed with
+        # nested fields and parts landed with dotted columns end up in the same columns.
+        # Snapshot entities (team, roster) are always landed whole, so only the latest part is read.
+        import pyarrow.parquet as pq
+
+        records = RecordStore()
+        partition = self._partition(entity, team_id, season)
+        if not partition.exists():
+            return records
+
+        files = sorted(
+            (file_path for file_path in partition.glob("date=*/part-*.parquet") if not until_date or file_path.parent.name[5:] <= until_date),
+            key=lambda file_path: (file_path.parent.name, file_path.name),
+        )
+
+        if snapshot:
+            files = files[-1:]
+
+        for file_path in files:
+            records.add(pq.read_table(file_path).to_pylist())
+        return records
+
+    def _partition(self, entity: str, team_id, season) -> Path:
+        return self.path / entity / f"team_id={team_id}" / f"season={season}"
@@ -1,54 +1,166 @@
-import boto3
 import logging
-from botocore.exceptions import ClientError
+import sys
+import threading
+
+# CloudWatch Logs limits for a single put_log_events call
+MAX_BATCH_COUNT = 10000
+MAX_BATCH_BYTES = 1048576
+EVENT_OVERHEAD_BYTES = 26
+MAX_EVENT_BYTES = 262144 - EVENT_OVERHEAD_BYTES
 
 class CloudWatchHandler(logging.Handler):
-    def __init__(self, log_group, stream_name, region_name='us-east-1'):
+    def __init__(
+        self,
+        log_group,
+        stream_name,
+        region_name='us-east-1',
+        client=None,
+        flush_interval: float = 5.0,
+        max_batch_count: int = MAX_BATCH_COUNT,
+        max_batch_bytes: int = MAX_BATCH_BYTES,
+    ):
         logging.Handler.__init__(self)
-        self.client = boto3.client('logs', region_name=region_name)
+        # boto3 is imported and the client created on the first send, so short runs don't pay for it up front
+        self.client = client
+        self.region_name = region_name
         self.log_group = log_group
         self.stream_name = stream_name
         self.sequence_token = None
+        self.flush_interval = flush_interval
+        self.max_batch_count = min(max_batch_count, MAX_BATCH_COUNT)
+        self.max_batch_bytes = min(max_batch_bytes, MAX_BATCH_BYTES)
 
-        # Create log group if it doesn't exist
-        try:
-            self.client.create_log_group(logGroupName=self.log_group)
-        except ClientError as e:
-            if e.response['Error']['Code'] != 'ResourceAlreadyExistsException':
-                raise
+        # Records are buffered by emit and sent in batches by the flusher thread
+        self.buffer = []
+        self.buffer_bytes = 0
+        self.buffer_condition = threading.Condition()
+        self.send_lock = threading.Lock()
+        self.closed = False
 
-        # Create log stream if it doesn't exist
-        try:
-            self.client.create_log_stream(logGroupName=self.log_group, logStreamName=self.stream_name)
-        except ClientError as e:
-            if e.response['Error']['Code'] != 'ResourceAlreadyExistsException':
-                raise
+        self.flusher = threading.Thread(target=self._flush_loop, name='cloudwatch-log-flusher', daemon=True)
+        self.flusher.start()
 
     def emit(self, record):
-        log_entry = self.format(record)
-        timestamp = int(record.created * 1000)
-        
+        try:
+            log_entry = self.format(record)
+        except Exception:
+            self.handleError(record)
+            return
+
+        message = log_entry.encode('utf-8')[:MAX_EVENT_BYTES].decode('utf-8', errors='ignore')
         log_event = {
-            'timestamp': timestamp,
-            'message': log_entry
-        }
-        
-        print(log_event)
-        
-        kwargs = {
-            'logGroupName': self.log_group,
-            'logStreamName': self.stream_name,
-            'logEvents': [log_event]
+            'timestamp': int(record.created * 1000),
+            'message': message
         }
-        
-        if self.sequence_token:
-            kwargs['sequenceToken'] = self.sequence_token
-        
-        try:
-            response = self.client.put_log_events(**kwargs)
-            self.sequence_token = response['nextSequenceToken']
-        except ClientError as e:
-            print(f"Error sending logs to CloudWatch: {e}")
+
+        with self.buffer_condition:
+            self.buffer.append(log_event)
+            self.buffer_bytes += len(message.encode('utf-8')) + EVENT_OVERHEAD_BYTES
+            if self._is_batch_full():
+                self.buffer_condition.notify()
+
+    def flush(self):
+        # Sends everything buffered so far, batch by batch. Draining under the send lock keeps batches in order.
+        with self.send_lock:
+            with self.buffer_condition:
+                log_events = self.buffer
+                self.buffer = []
+                self.buffer_bytes = 0
+            self._send(log_events)
+
+    def close(self):
+        # logging.shutdown closes every handler at exit, so buffered records are not lost
+        with self.buffer_condition:
+            self.closed = True
+            self.buffer_condition.notify()
+        if self.flusher.is_alive() and self.flusher is not threading.current_thread():
+            self.flusher.join()
+        self.flush()
+        logging.Handler.close(self)
+
+    def _is_batch_full(self):
+        return len(self.buffer) >= self.max_batch_count or self.buffer_bytes >= self.max_batch_bytes
+
+    def _flush_loop(self):
+        while True:
+            with self.buffer_condition:
+                if not self.closed and not self._is_batch_full():
+                    self.buffer_condition.wait(self.flush_interval)
+                closed = self.closed
+            self.flush()
+            if closed:
+                return
+
+    def _get_client(self):
+        if self.client is None:
+            import boto3
+            self.client = boto3.client('logs', region_name=self.region_name)
+        return self.client
+
+    def _create_log_stream(self):
+        from botocore.exceptions import ClientError
+
+        # Only called when a send finds the group or stream missing, not on every start
+        for create, kwargs in (
+            (self.client.create_log_group, {'logGroupName': self.log_group}),
+            (self.client.create_log_stream, {'logGroupName': self.log_group, 'logStreamName': self.stream_name}),
+        ):
+            try:
+                create(**kwargs)
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ResourceAlreadyExistsException':
+                    raise
+
+    def _send(self, log_events):
+        if len(log_events) == 0:
+            return
+
+        from botocore.exceptions import ClientError
+
+        client = self._get_client()
+        # Records emitted from several threads may be slightly out of order, which CloudWatch rejects
+        log_events.sort(key=lambda log_event: log_event['timestamp'])
+
+        for batch in self._batches(log_events):
+            kwargs = {
+                'logGroupName': self.log_group,
+                'logStreamName': self.stream_name,
+                'logEvents': batch
+            }
+
+            if self.sequence_token:
+                kwargs['sequenceToken'] = self.sequence_token
+
+            try:
+                try:
+                    response = client.put_log_events(**kwargs)
+                except ClientError as e:
+                    if e.response['Error']['Code'] != 'ResourceNotFoundException':
+                        raise
+                    self._create_log_stream()
+                    response = client.put_log_events(**kwargs)
+                self.sequence_token = response.get('nextSequenceToken')
+            except Exception as e:
+                sys.stderr.write(f"Error sending {len(batch)} logs to CloudWatch: {e}\n")
+
+    def _batches(self, log_events):
+        batch = []
+        batch_bytes = 0
+        for log_event in log_events:
+            event_bytes = len(log_event['message'].encode('utf-8')) + EVENT_OVERHEAD_BYTES
+            # A batch must stay within the count and byte limits and span less than 24 hours
+            if len(batch) > 0 and (
+                len(batch) >= self.max_batch_count
+                or batch_bytes + event_bytes > self.max_batch_bytes
+                or log_event['timestamp'] - batch[0]['timestamp'] >= 24 * 3600 * 1000
+            ):
+                yield batch
+                batch = []
+                batch_bytes = 0
+            batch.append(log_event)
+            batch_bytes += event_bytes
+        if len(batch) > 0:
+            yield batch
 
 def get_logger(name, log_group, stream_name):
     logger = logging.getLogger(name)
@@ -58,4 +170,3 @@ def get_logger(name, log_group, stream_name):
     handler.setFormatter(formatter)
     logger.addHandler(handler)
     return logger
-
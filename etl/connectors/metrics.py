@@ -0,0 +1,127 @@
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+THROUGHPUT_BUCKETS = (100, 500, 1000, 5000, 10000, 50000, 100000, 500000)
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.started_cpu = time.process_time()
+        self.timers = {}
+        self.counters = {}
+        self.histograms = {}
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        # Wall time and CPU time of the calling thread, stages run concurrently on their own threads
+        started_at = time.perf_counter()
+        started_cpu = time.thread_time()
+        try:
+            yield
+        finally:
+            self.record_time(name, time.perf_counter() - started_at, time.thread_time() - started_cpu, **labels)
+
+    def record_time(self, name: str, wall_seconds: float, cpu_seconds: float, **labels) -> None:
+        with self.lock:
+            timer = self.timers.setdefault(self._key(name, labels), {"count": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0})
+            timer["count"] += 1
+            timer["wall_seconds"] += wall_seconds
+            timer["cpu_seconds"] += cpu_seconds
+
+    def increment(self, name: str, value: float = 1, **labels) -> None:
+        with self.lock:
+            key = self._key(name, labels)
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, buckets: tuple = LATENCY_BUCKETS, **labels) -> None:
+        with self.lock:
+            histogram = self.histograms.setdefault(
+                self._key(name, labels), {"buckets": buckets, "counts": [0] * len(buckets), "count": 0, "sum": 0.0}
+            )
+            histogram["count"] += 1
+            histogram["sum"] += value
+            for i, bound in enumerate(histogram["buckets"]):
+                if value <= bound:
+                    histogram["counts"][i] += 1
+
+    def peak_rss_bytes(self):
+        if resource is None:
+            return None
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Reported in bytes on macOS and in kilobytes on Linux
+        return peak_rss if sys.platform == "darwin" else peak_rss * 1024
+
+    def report(self) -> dict:
+        with self.lock:
+            return {
+                "wall_seconds": time.time() - self.started_at,
+                "cpu_seconds": time.process_time() - self.started_cpu,
+                "peak_rss_bytes": self.peak_rss_bytes(),
+                "timers": [dict(self._labels(key), **timer) for key, timer in self.timers.items()],
+                "counters": [dict(self._labels(key), value=value) for key, value in self.counters.items()],
+                "histograms": [
+                    dict(self._labels(key), buckets=dict(zip(map(str, histogram["buckets"]), histogram["counts"])), count=histogram["count"], sum=histogram["sum"])
+                    for key, histogram in self.histograms.items()
+                ],
+            }
+
+    def to_json(self) -> str:
+        return json.dumps(self.report(), indent=2, default=str)
+
+    def to_prometheus(self, prefix: str = "etl") -> str:
+        report = self.report()
+        lines = [
+            f"{prefix}_run_wall_seconds {report['wall_seconds']}",
+            f"{prefix}_run_cpu_seconds {report['cpu_seconds']}",
+        ]
+        if report["peak_rss_bytes"] is not None:
+            lines.append(f"{prefix}_peak_rss_bytes {report['peak_rss_bytes']}")
+
+        for timer in report["timers"]:
+            name, labels = self._prometheus_name(prefix, timer, ("count", "wall_seconds", "cpu_seconds"))
+            lines.append(f"{name}_wall_seconds_total{labels} {timer['wall_seconds']}")
+            lines.append(f"{name}_cpu_seconds_total{labels} {timer['cpu_seconds']}")
+            lines.append(f"{name}_calls_total{labels} {timer['count']}")
+
+        for counter in report["counters"]:
+            name, labels = self._prometheus_name(prefix, counter, ("value",))
+            lines.append(f"{name}_total{labels} {counter['value']}")
+
+        for histogram in report["histograms"]:
+            name, labels = self._prometheus_name(prefix, histogram, ("buckets", "count", "sum"))
+            label_prefix = labels[:-1] + "," if labels else "{"
+            for bound, count in histogram["buckets"].items():
+                lines.append(f'{name}_bucket{label_prefix}le="{bound}"}} {count}')
+            lines.append(f'{name}_bucket{label_prefix}le="+Inf"}} {histogram["count"]}')
+            lines.append(f"{name}_sum{labels} {histogram['sum']}")
+            lines.append(f"{name}_count{labels} {histogram['count']}")
+
+        return "\n".join(lines) + "\n"
+
+    def _key(self, name: str, labels: dict):
+        return (name, tuple(sorted((label, str(value)) for label, value in labels.items())))
+
+    def _labels(self, key) -> dict:
+        name, labels = key
+        return dict(labels, name=name)
+
+    def _prometheus_name(self, prefix: str, entry: dict, fields: tuple):
+        labels = {label: value for label, value in entry.items() if label != "name" and label not in fields}
+        label_list = ",".join(f'{label}="{value}"' for label, value in sorted(labels.items()))
+        return f"{prefix}_{entry['name']}", f"{{{label_list}}}" if label_list else ""
+
+metrics = Metrics()
+
+def get_metrics() -> Metrics:
+    # One registry per process, shared by every stage and every batch target
+    return metrics
@@ -1,9 +1,52 @@
-from sqlalchemy import create_engine, Table, MetaData, inspect, text
-from sqlalchemy.engine import URL
+from sqlalchemy import create_engine, Table, MetaData, inspect, text, tuple_, literal_column
+from sqlalchemy.engine import URL, Connection
 from sqlalchemy.dialects.postgresql import insert
 from pandas import DataFrame
+from io import StringIO
+from uuid import uuid4
+from threading import Lock
+from time import perf_counter, thread_time
 from jinja2 import Environment
 from logging import Logger
+from etl.connectors.metrics import get_metrics, THROUGHPUT_BUCKETS
+
+class MetadataCache:
+    # Process-wide: every client of the same database shares what is known about its tables
+    def __init__(self):
+        self.lock = Lock()
+        self.existing_tables = set()
+        self.reflected_tables = {}
+        self.catalog_queries_saved = 0
+
+    def exists(self, database: str, table_name: str) -> bool:
+        with self.lock:
+            if (database, table_name.lower()) in self.existing_tables:
+                self.catalog_queries_saved += 1
+                return True
+            return False
+
+    def add(self, database: str, table_name: str) -> None:
+        with self.lock:
+            self.existing_tables.add((database, table_name.lower()))
+
+    def get_table(self, database: str, table_name: str):
+        with self.lock:
+            table = self.reflected_tables.get((database, table_name.lower()))
+            if table is not None:
+                self.catalog_queries_saved += 1
+            return table
+
+    def add_table(self, database: str, table: Table) -> None:
+        with self.lock:
+            self.existing_tables.add((database, table.name.lower()))
+            self.reflected_tables[(database, table.name.lower())] = table
+
+    def invalidate(self, database: str, table_name: str) -> None:
+        with self.lock:
+            self.existing_tables.discard((database, table_name.lower()))
+            self.reflected_tables.pop((database, table_name.lower()), None)
+
+metadata_cache = MetadataCache()
 
 class PostgreSqlClient:
     def __init__(
@@ -14,6 +57,7 @@ class PostgreSqlClient:
         username: str,
         password: str,
         port: int = 5432,
+        pool_size: int = 5,
     ):
         self.host_name = server_name
         self.database_name = database_name
@@ -31,7 +75,9 @@ class PostgreSqlClient:
             database=database_name,
         )
 
-        self.engine = create_engine(connection_url)
+        # One engine is shared by every worker of a batch run, so the pool must fit them all
+        self.engine = create_engine(connection_url, pool_size=pool_size, max_overflow=pool_size)
+        self.database_key = connection_url.render_as_string(hide_password=True)
 
     def execute_sql(self, sql: str) -> None:
         self.engine.execute(sql)
@@ -40,30 +86,55 @@ class PostgreSqlClient:
         result = self.engine.execute(text(query))
         return [dict(row) for row in result]
     
-    def select_max_id(self, table_name: str) -> int:
+    def select_max_id(self, table_name: str, scope: dict = None) -> int:
         if not self.table_exists(table_name):
             return 0
-        result = self.select(f"select max(id) from {table_name}")
-        return result[0]['max']
+        if not scope:
+            result = self.select(f"select max(id) from {table_name}")
+            return result[0]['max']
+        conditions = " AND ".join(f'"{column}" = :{column}' for column in scope)
+        result = self.engine.execute(text(f"select max(id) from {table_name} where {conditions}"), scope)
+        return result.scalar()
     
     def table_exists(self, table_name: str) -> bool:
-        return inspect(self.engine).has_table(table_name)
+        # Only existing tables are cached, a missing table may be created by another client at any time
+        if metadata_cache.exists(self.database_key, table_name):
+            return True
+        exists = inspect(self.engine).has_table(table_name)
+        if exists:
+            metadata_cache.add(self.database_key, table_name)
+        return exists
+    
+    def get_table(self, table_name: str) -> Table:
+        table = metadata_cache.get_table(self.database_key, table_name)
+        if table is None:
+            table = Table(table_name, MetaData(), autoload_with=self.engine)
+            metadata_cache.add_table(self.database_key, table)
+        return table
+    
+    @property
+    def catalog_queries_saved(self) -> int:
+        return metadata_cache.catalog_queries_saved
     
     def create_table(self, table_name: str, table_file_name: str, tables_template: Environment) -> None:
         team_table = tables_template.get_template(f"{table_file_name}.sql.j2")
         exec_sql = team_table.render(table_name=table_name)
-        self.execute_sql(exec_sql)
+        with self.engine.begin() as connection:
+            self._lock(connection, table_name)
+            connection.execute(exec_sql)
+        metadata_cache.invalidate(self.database_key, table_name)
+        metadata_cache.add(self.database_key, table_name)
         self.logger.info(f"Table {table_name} created.")
 
     def insert(self, data: DataFrame, tables_template: Environment, table_name: str, file_name: str, chunk_size: int, mode: str) -> None:      
         if not self.table_exists(table_name):
             self.create_table(table_name, file_name, tables_template)
         
-        table = Table(table_name, MetaData(), autoload_with=self.engine)
+        table = self.get_table(table_name)
         
         for chunk in range(0, len(data), chunk_size):
             chunk_data = data.iloc[chunk:chunk + chunk_size]
-            data_dict = chunk_data.to_dict(orient='records')
+            data_dict = self._to_records(chunk_data)
             stmt = insert(table).values(data_dict)
             self.engine.execute(stmt)
             self.logger.info(f"Inserted chunk {chunk//chunk_size + 1} into table {table_name}")
@@ -74,23 +145,250 @@ class PostgreSqlClient:
         team_tables = [table for table in tables if team_name in table.lower() and season in table.lower()]
         for table in team_tables:
             self.execute_sql(f"DROP TABLE {table} CASCADE")
+            metadata_cache.invalidate(self.database_key, table)
             self.logger.info(f"Table {table} dropped.")
 
-    def upsert(self, data: DataFrame, tables_template: Environment, table_name: str, file_name: str, chunk_size: int) -> None:
+    def upsert(self, data: DataFrame, tables_template: Environment, table_name: str, file_name: str, chunk_size: int, method: str = "values", connection: Connection = None, conflict_columns: list = None) -> dict:
+        # Rows whose values did not change are not rewritten. Returns the inserted/updated/unchanged counts
+        # and the ids of the inserted rows.
+        # The whole frame is written in one transaction, the caller's when `connection` is given.
         if not self.table_exists(table_name):
             self.create_table(table_name, file_name, tables_template)
 
-        table = Table(table_name, MetaData(), autoload_with=self.engine)
-        
+        table = self.get_table(table_name)
+        conflict_columns = conflict_columns or ['id']
+
+        if connection is None:
+            with self.engine.begin() as connection:
+                return self._upsert(data, table, chunk_size, method, connection, conflict_columns)
+        return self._upsert(data, table, chunk_size, method, connection, conflict_columns)
+
+    def transaction(self):
+        return self.engine.begin()
+
+    def accumulate(self, template_name: str, tables_template: Environment, table_name: str, file_name: str, source_table_name: str, ids: list, connection: Connection, scope: dict = None) -> None:
+        # Merges the aggregate of the given source rows into running totals, see the template for the merge rules
+        if not self.table_exists(table_name):
+            self.create_table(table_name, file_name, tables_template)
+
+        # `scope` columns (team and season of the partitioned layout) are part of the totals' key
+        scope = scope or {}
+
+        # Tables created before running totals were kept have no game count yet. It is counted in the same
+        # transaction from the rows already accumulated, of every scope and season as a partition's column
+        # is added to its parent table, while the rows of this run are added below.
+        if "gamesPlayed" not in self.get_table(table_name).columns:
+            parent_name, source_parent_name = self._parent_table(connection, table_name), self._parent_table(connection, source_table_name)
+            connection.execute(f'ALTER TABLE {parent_name} ADD COLUMN IF NOT EXISTS "gamesPlayed" INT')
+            scope_join = "".join(f' AND stats."{column}" = overall."{column}"' for column in scope)
+            result = connection.execute(text(
+                f'UPDATE {parent_name} AS overall SET "gamesPlayed" = ('
+                f'SELECT COUNT(stats."minutesPlayed") FROM {source_parent_name} AS stats '
+                f'WHERE stats."playerId" = overall.id{scope_join} AND NOT stats.id = ANY(:ids)'
+                f') WHERE overall."gamesPlayed" IS NULL'
+            ), {"ids": ids})
+            for name in [parent_name, *self._partition_names(connection, parent_name)]:
+                metadata_cache.invalidate(self.database_key, name)
+            self.logger.info(f"Backfilled the game count of {result.rowcount} rows in table {parent_name}")
+
+        exec_sql = tables_template.get_template(f"{template_name}.sql.j2").render(
+            table_name=table_name, source_table_name=source_table_name, scope_columns=list(scope)
+        )
+        connection.execute(text(exec_sql), dict(scope, ids=ids))
+        self.logger.info(f"Accumulated {len(ids)} new rows of {source_table_name} into table {table_name}")
+
+    def recount_record(self, template_name: str, tables_template: Environment, table_name: str, connection: Connection, scope: dict = None) -> None:
+        # Counts the running wins and losses again over every loaded game of the team and season, in the games' id order
+        scope = scope or {}
+        exec_sql = tables_template.get_template(f"{template_name}.sql.j2").render(table_name=table_name, scope_columns=list(scope))
+        result = connection.execute(text(exec_sql), scope)
+        self.logger.info(f"Recounted the cumulative record of {result.rowcount} games in table {table_name}")
+
+    def create_partition(self, table_name: str, table_file_name: str, tables_template: Environment, season: int) -> None:
+        # Creates the season partition of a partitioned table, and the table itself when missing
+        partition_name = f"{table_name}_{season}"
+        if self.table_exists(partition_name):
+            return
+
+        if not self.table_exists(table_name):
+            self.create_table(table_name, table_file_name, tables_template)
+
+        with self.engine.begin() as connection:
+            self._lock(connection, partition_name)
+            connection.execute(f"CREATE TABLE IF NOT EXISTS {partition_name} PARTITION OF {table_name} FOR VALUES IN ({int(season)})")
+        metadata_cache.add(self.database_key, partition_name)
+        self.logger.info(f"Partition {partition_name} of table {table_name} created.")
+
+    def ensure_column(self, table_name: str, column_name: str, column_type: str) -> None:
+        # Adds a column to tables created before it existed, the partitions of a partitioned table get it too
+        if column_name in self.get_table(table_name).columns:
+            return
+
+        with self.engine.begin() as connection:
+            connection.execute(f'ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS "{column_name}" {column_type}')
+            partition_names = self._partition_names(connection, table_name)
+        for name in [table_name, *partition_names]:
+            metadata_cache.invalidate(self.database_key, name)
+        self.logger.info(f"Column {column_name} added to table {table_name}.")
+
+    def delete_scope(self, table_name: str, scope: dict, connection: Connection) -> int:
+        # Clears the rows of one team and season, the partition and the scope index keep it from scanning other rows
+        conditions = " AND ".join(f'"{column}" = :{column}' for column in scope)
+        result = connection.execute(text(f"DELETE FROM {table_name} WHERE {conditions}"), scope)
+        self.logger.info(f"Deleted {result.rowcount} rows of table {table_name} where {scope}")
+        return result.rowcount
+
+    def refresh_materialized_view(self, view_name: str, view_file_name: str, tables_template: Environment, connection: Connection = None, **template_variables) -> None:
+        # Creates the view with its data the first time, later calls refresh it. In the caller's transaction when `connection` is given.
+        if connection is None:
+            with self.engine.begin() as connection:
+                return self.refresh_materialized_view(view_name, view_file_name, tables_template, connection, **template_variables)
+
+        self._lock(connection, view_name)
+        relkind = connection.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:name)"), {"name": view_name}).scalar()
+        if relkind == "m":
+            # CONCURRENTLY keeps the view readable while it refreshes, it relies on the view's unique index
+            connection.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {view_name}")
+            self.logger.info(f"Materialized view {view_name} refreshed.")
+            return
+
+        dropped_tables = [view_name]
+        if relkind is not None:
+            # A table of the same output derived in Python by earlier runs, its partitions go with it
+            dropped_tables += self._partition_names(connection, view_name)
+            connection.execute(f"DROP TABLE {view_name} CASCADE")
+        connection.execute(tables_template.get_template(f"{view_file_name}.sql.j2").render(table_name=view_name, **template_variables))
+        for table_name in dropped_tables:
+            metadata_cache.invalidate(self.database_key, table_name)
+        self.logger.info(f"Materialized view {view_name} created.")
+
+    def drop_materialized_views(self, view_names: list[str]) -> None:
+        result = self.engine.execute(text("SELECT matviewname FROM pg_matviews WHERE matviewname = ANY(:names)"), {"names": [name.lower() for name in view_names]})
+        for (view_name,) in result.fetchall():
+            self.execute_sql(f"DROP MATERIALIZED VIEW IF EXISTS {view_name} CASCADE")
+            metadata_cache.invalidate(self.database_key, view_name)
+            self.logger.info(f"Materialized view {view_name} dropped.")
+
+    def drop_table(self, table_name: str) -> None:
+        self.execute_sql(f"DROP TABLE IF EXISTS {table_name} CASCADE")
+        metadata_cache.invalidate(self.database_key, table_name)
+
+    def swap_tables(self, table_names: list[tuple], connection: Connection = None) -> None:
+        # Replaces every target table with its shadow table in a single transaction, readers never see a missing table.
+        # Views dropped with the old tables can be recreated in the same transaction when the caller's `connection` is given.
+        if connection is None:
+            with self.engine.begin() as connection:
+                return self.swap_tables(table_names, connection)
+
+        for table_name, shadow_table_name in table_names:
+            connection.execute(f"DROP TABLE IF EXISTS {table_name} CASCADE")
+            connection.execute(f"ALTER TABLE {shadow_table_name} RENAME TO {table_name}")
+            connection.execute(f"ALTER INDEX IF EXISTS {shadow_table_name}_pkey RENAME TO {table_name}_pkey")
+        for table_name, shadow_table_name in table_names:
+            metadata_cache.invalidate(self.database_key, table_name)
+            metadata_cache.invalidate(self.database_key, shadow_table_name)
+        self.logger.info(f"Tables {', '.join(table_name for table_name, _ in table_names)} swapped in.")
+
+    def _upsert(self, data: DataFrame, table: Table, chunk_size: int, method: str, connection: Connection, conflict_columns: list) -> dict:
+        if method == "copy":
+            try:
+                # A savepoint lets the fallback reuse the transaction if COPY fails
+                with connection.begin_nested():
+                    return self._copy_upsert(data, table, connection, conflict_columns)
+            except Exception as e:
+                self.logger.warning(f"COPY upsert into table {table.name} failed, falling back to INSERT ... VALUES: {e}")
+
+        return self._values_upsert(data, table, chunk_size, connection, conflict_columns)
+
+    def _values_upsert(self, data: DataFrame, table: Table, chunk_size: int, connection: Connection, conflict_columns: list) -> dict:
+        # Columns the frame does not have keep their stored values, like the COPY path
+        update_columns = [c for c in table.columns if c.name not in conflict_columns and c.name in data.columns]
+        counts = {"inserted": 0, "updated": 0, "unchanged": 0, "inserted_ids": []}
+
         for chunk in range(0, len(data), chunk_size):
+            started_at, started_cpu = perf_counter(), thread_time()
             chunk_data = data.iloc[chunk:chunk + chunk_size]
-            data_dict = chunk_data.to_dict(orient='records')
+            data_dict = self._to_records(chunk_data)
 
             stmt = insert(table).values(data_dict)
             on_conflict_stmt = stmt.on_conflict_do_update(
-                index_elements=['id'],
-                set_={c.name: stmt.excluded[c.name] for c in table.columns if c.name != 'id'}
-            )
+                index_elements=conflict_columns,
+                set_={c.name: stmt.excluded[c.name] for c in update_columns},
+                where=tuple_(*update_columns).is_distinct_from(tuple_(*[stmt.excluded[c.name] for c in update_columns]))
+            ).returning(table.c.id, literal_column("xmax = 0").label("inserted"))
+
+            written = [(row.id, row.inserted) for row in connection.execute(on_conflict_stmt)]
+            self._count_written(counts, written, len(chunk_data))
+            self._record_chunk(table.name, "values", len(chunk_data), perf_counter() - started_at, thread_time() - started_cpu)
+            self.logger.info(f"Upserted chunk {chunk//chunk_size + 1} into table {table.name}")
+
+        return counts
+
+    def _copy_upsert(self, data: DataFrame, table: Table, connection: Connection, conflict_columns: list, copy_chunk_size: int = 100000) -> dict:
+        # Streams the frame into a temporary staging table with COPY, then merges it with one set-based statement
+        columns = [c.name for c in table.columns if c.name in data.columns]
+        data = data[columns].drop_duplicates(subset=conflict_columns, keep='last')
+
+        # Unique per call, several upserts can share one transaction
+        staging_name = f"staging_{uuid4().hex[:8]}"
+        column_list = ", ".join(f'"{column}"' for column in columns)
+        update_columns = [column for column in columns if column not in conflict_columns]
+        conflict_list = ", ".join(f'"{column}"' for column in conflict_columns)
+        update_list = ", ".join(f'"{column}" = EXCLUDED."{column}"' for column in update_columns)
+        current_values = ", ".join(f'{table.name}."{column}"' for column in update_columns)
+        excluded_values = ", ".join(f'EXCLUDED."{column}"' for column in update_columns)
+        counts = {"inserted": 0, "updated": 0, "unchanged": 0, "inserted_ids": []}
+
+        started_at, started_cpu = perf_counter(), thread_time()
+        cursor = connection.connection.cursor()
+        cursor.execute(f"CREATE TEMP TABLE {staging_name} (LIKE {table.name} INCLUDING DEFAULTS) ON COMMIT DROP")
+
+        for chunk in range(0, len(data), copy_chunk_size):
+            buffer = StringIO()
+            data.iloc[chunk:chunk + copy_chunk_size].to_csv(buffer, index=False, header=False)
+            buffer.seek(0)
+            cursor.execute(f"COPY {staging_name} ({column_list}) FROM STDIN WITH (FORMAT csv)", stream=buffer)
+
+        cursor.execute(
+            f"INSERT INTO {table.name} ({column_list}) SELECT {column_list} FROM {staging_name} "
+            f"ON CONFLICT ({conflict_list}) DO UPDATE SET {update_list} "
+            f"WHERE ({current_values}) IS DISTINCT FROM ({excluded_values}) "
+            f"RETURNING id, (xmax = 0)"
+        )
+        written = [(row[0], row[1]) for row in cursor.fetchall()]
+        cursor.execute(f"DROP TABLE {staging_name}")
+
+        self._count_written(counts, written, len(data))
+        self._record_chunk(table.name, "copy", len(data), perf_counter() - started_at, thread_time() - started_cpu)
+        self.logger.info(f"Upserted {len(data)} rows into table {table.name} with COPY")
+        return counts
+
+    def _lock(self, connection: Connection, name: str) -> None:
+        # Held until the transaction ends, concurrent CREATE TABLE IF NOT EXISTS can otherwise still collide in the catalog
+        connection.execute(text("SELECT pg_advisory_xact_lock(hashtext(:name))"), {"name": name})
+
+    def _partition_names(self, connection: Connection, table_name: str) -> list[str]:
+        return [name for (name,) in connection.execute(text("SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = to_regclass(:name)"), {"name": table_name})]
+
+    def _parent_table(self, connection: Connection, table_name: str) -> str:
+        # The partitioned table a partition belongs to, the table itself otherwise
+        parent_name = connection.execute(text("SELECT inhparent::regclass::text FROM pg_inherits WHERE inhrelid = to_regclass(:name)"), {"name": table_name}).scalar()
+        return parent_name or table_name
+
+    def _record_chunk(self, table_name: str, method: str, rows: int, seconds: float, cpu_seconds: float) -> None:
+        get_metrics().increment("upsert_rows", rows, table=table_name, method=method)
+        get_metrics().record_time("upsert_chunk", seconds, cpu_seconds, table=table_name, method=method)
+        if seconds > 0:
+            get_metrics().observe("upsert_rows_per_second", rows / seconds, THROUGHPUT_BUCKETS, table=table_name, method=method)
+
+    def _count_written(self, counts: dict, written: list, total: int) -> None:
+        # RETURNING yields one (id, is insert) row per written row, (xmax = 0) is true for fresh inserts
+        inserted_ids = [row_id for row_id, is_insert in written if is_insert]
+        counts["inserted_ids"].extend(inserted_ids)
+        counts["inserted"] += len(inserted_ids)
+        counts["updated"] += len(written) - len(inserted_ids)
+        counts["unchanged"] += total - len(written)
 
-            self.engine.execute(on_conflict_stmt)
-            self.logger.info(f"Upserted chunk {chunk//chunk_size + 1} into table {table_name}")
+    def _to_records(self, data: DataFrame) -> list[dict]:
+        # Missing values (NaN/NA) are sent as NULL, pg8000 can't bind NaN to INT columns
+        return data.astype(object).where(data.notna(), None).to_dict(orient='records')
@@ -0,0 +1,92 @@
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from etl.connectors.metrics import get_metrics
+
+class RateLimiter:
+    def __init__(self, requests_per_minute: float = 60, burst: int = None, safety_factor: float = 0.9):
+        self.safety_factor = safety_factor
+        self.rate = requests_per_minute * safety_factor / 60
+        self.capacity = burst or max(1, int(requests_per_minute * safety_factor / 10))
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self) -> float:
+        # Blocks until a token is available and returns the time spent waiting
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                # Waits caused by a 429 or an exhausted quota are told apart from regular throttling
+                backoff = self.paused_until - now
+                wait = max(backoff, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+            waited += wait
+            get_metrics().increment("rate_limiter_wait_seconds", wait, reason="backoff" if backoff >= wait else "throttle")
+
+    def update_from_headers(self, headers) -> None:
+        limit = headers.get("X-RateLimit-Limit")
+        remaining = headers.get("X-RateLimit-Remaining")
+        reset = headers.get("X-RateLimit-Reset")
+
+        with self.lock:
+            if limit and limit.isdigit():
+                learned_rate = int(limit) * self.safety_factor / 60
+                if learned_rate != self.rate:
+                    self._refill(time.monotonic())
+                    self.rate = learned_rate
+                    self.capacity = max(1, int(int(limit) * self.safety_factor / 10))
+                    self.tokens = min(self.tokens, self.capacity)
+
+            if remaining == "0" and reset:
+                self._pause(self._parse_reset(reset))
+
+    def penalize(self, retry_after: str = None) -> float:
+        # Called on a 429: every thread sharing the limiter waits out the same pause
+        with self.lock:
+            seconds = self._parse_retry_after(retry_after)
+            get_metrics().increment("http_429_backoffs")
+            if seconds is None:
+                # The quota was overestimated, back off and slow down the steady rate
+                self.rate = self.rate * 0.8
+                seconds = self.capacity / self.rate
+            self._pause(seconds)
+            return seconds
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def _pause(self, seconds: float) -> None:
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    def _parse_retry_after(self, retry_after: str):
+        if not retry_after:
+            return None
+        if retry_after.isdigit():
+            return int(retry_after)
+        try:
+            retry_at = parsedate_to_datetime(retry_after)
+        except (TypeError, ValueError):
+            return None
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+    def _parse_reset(self, reset: str) -> float:
+        # Either seconds until reset or an epoch timestamp
+        try:
+            seconds = float(reset)
+        except ValueError:
+            return 0.0
+        if seconds > time.time() / 2:
+            seconds = seconds - time.time()
+        return max(0.0, seconds)
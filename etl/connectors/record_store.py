@@ -0,0 +1,81 @@
+import threading
+
+class RecordStore:
+    # Extracted records of one entity, one row per id with the latest version winning. Rows are held as columns,
+    # nested objects flattened into dotted columns (`player.id`), so retried pages and overlapping shards are
+    # deduplicated as they arrive and a batch costs a list per field instead of a dict per record.
+    def __init__(self, records: list[dict] = None, key: str = "id"):
+        self.key = key
+        self.lock = threading.Lock()
+        self.data = {}
+        self.rows = {}
+        if records:
+            self.add(records)
+
+    def add(self, records: list[dict]) -> int:
+        # Returns how many of the records had an id not seen before
+        added = 0
+        with self.lock:
+            for record in records:
+                values = self._flatten(record)
+                row = self.rows.get(values.get(self.key))
+                if row is None:
+                    row = len(self.rows)
+                    self.rows[values.get(self.key)] = row
+                    for column in self.data.values():
+                        column.append(None)
+                    added += 1
+                else:
+                    # A later version replaces the whole record, fields it no longer has are cleared
+                    for column in self.data.values():
+                        column[row] = None
+
+                for name, value in values.items():
+                    column = self.data.get(name)
+                    if column is None:
+                        column = self.data[name] = [None] * len(self.rows)
+                    column[row] = value
+        return added
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __contains__(self, record_id) -> bool:
+        return record_id in self.rows
+
+    def ids(self) -> list:
+        with self.lock:
+            return list(self.rows)
+
+    def column(self, name: str) -> list:
+        with self.lock:
+            return list(self.data.get(name) or [None] * len(self.rows))
+
+    def columns(self, names: list[str] = None) -> dict:
+        # Columnar batch, requested columns the records never had are all None
+        with self.lock:
+            names = list(self.data) if names is None else names
+            return {name: list(self.data.get(name) or [None] * len(self.rows)) for name in names}
+
+    def records(self) -> list[dict]:
+        with self.lock:
+            return [{name: column[row] for name, column in self.data.items()} for row in range(len(self.rows))]
+
+    def filter(self, name: str, predicate) -> "RecordStore":
+        # New store with the rows whose `name` column satisfies the predicate
+        with self.lock:
+            rows = [row for row, value in enumerate(self.data.get(name) or [None] * len(self.rows)) if predicate(value)]
+            store = RecordStore(key=self.key)
+            record_ids = list(self.rows)
+            store.rows = {record_ids[row]: i for i, row in enumerate(rows)}
+            store.data = {column_name: [column[row] for row in rows] for column_name, column in self.data.items()}
+            return store
+
+    def _flatten(self, record: dict, prefix: str = "") -> dict:
+        values = {}
+        for name, value in record.items():
+            if isinstance(value, dict):
+                values.update(self._flatten(value, f"{prefix}{name}."))
+            else:
+                values[f"{prefix}{name}"] = value
+        return values
@@ -1,78 +1,571 @@
+from __future__ import annotations
 from dotenv import load_dotenv
 from pathlib import Path
-import yaml
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread, Event
+from queue import Queue, Full
+from logging import Logger
+from typing import TYPE_CHECKING
 import os
+import sys
 from etl.assets.extractors.extract_balldontlie import ExtractBalldontlie
-from etl.assets.tranformers.transform_balldontlie import TransformBalldontlie
-from etl.assets.loader.load_balldontlie import LoadBalldontlie
-from etl.connectors.postgresql import PostgreSqlClient
 from etl.connectors.logger import get_logger
-from jinja2 import Environment, FileSystemLoader
-from etl.connectors.config_manager import get_parameter
+from etl.connectors.http_client import HttpClient
+from etl.connectors.rate_limiter import RateLimiter
+from etl.connectors.http_cache import HttpCache
+from etl.connectors.checkpoint_store import CheckpointStore
+from etl.connectors.metrics import get_metrics
+from etl.connectors.landing_zone import LandingZone
+from etl.connectors.record_store import RecordStore
+from etl.connectors.config_manager import ConfigManager, LocalParameterStore, get_config_manager
 
-def get_config():
+# pandas, SQLAlchemy and Jinja2 are imported on first use, a scheduled run with nothing new exits before loading them
+if TYPE_CHECKING:
+    from jinja2 import Environment
+    from etl.assets.tranformers.transform_balldontlie import TransformBalldontlie
+    from etl.connectors.postgresql import PostgreSqlClient
+
+def get_config(config_manager: ConfigManager = None):
     isDevelopment = os.environ.get("ENV") == "dev"
     if(isDevelopment):
         yaml_file_path = __file__.replace(".py", ".yaml")
-       
+
         if Path(yaml_file_path).exists():
+            import yaml
             with open(yaml_file_path) as yaml_file:
                 pipeline_config = yaml.safe_load(yaml_file)
                 return pipeline_config
         else:
             raise Exception(f"Missing {yaml_file_path} file")
-        
-    config = {
-        "team_id": get_parameter('team_id'),
-        "season": get_parameter('season'),
-        "api_url": get_parameter('api_url')
+
+    # One batched SSM call for every parameter, none while the local cache is fresh
+    config_manager = config_manager or get_config_manager()
+    return config_manager.get_parameters(["team_id", "season", "api_url", "targets"])
+
+def get_targets(config: dict) -> list[tuple]:
+    # `targets` is either a list of {team_id, season} (yaml) or a "team:season,team:season" string (SSM/env)
+    targets = os.environ.get("TARGETS") or config.get("targets")
+    if not targets:
+        return [(config.get("team_id"), config.get("season"))]
+
+    if isinstance(targets, str):
+        pairs = [target.strip().split(":") for target in targets.split(",") if target.strip()]
+        return [(team_id.strip(), season.strip()) for team_id, season in pairs]
+
+    return [(target.get("team_id"), target.get("season")) for target in targets]
+
+def run_pipeline(
+    logger: Logger,
+    sql_client: PostgreSqlClient,
+    http_client: HttpClient,
+    tables_template: Environment,
+    api_key: str,
+    api_url: str,
+    team_id: int,
+    season: str,
+    mode: str,
+    streaming: bool = False,
+    stream_batch_size: int = 1000,
+    stream_queue_size: int = 4,
+    load_method: str = "copy",
+    load_workers: int = 5,
+    checkpoint_store: CheckpointStore = None,
+    stats_chunk_size: int = 25,
+    stats_date_shards: int = 1,
+    start_date: str = None,
+    end_date: str = None,
+    window_days: int = 3,
+    landing_zone: LandingZone = None,
+    replay: bool = False,
+    layout: str = "per_team",
+    derive_in_db: bool = False,
+) -> dict:
+    # Date windows hold a few games and replays read local files, they always go through the regular path
+    if streaming and mode != "window" and not replay:
+        return run_streaming_pipeline(
+            logger=logger,
+            sql_client=sql_client,
+            http_client=http_client,
+            tables_template=tables_template,
+            api_key=api_key,
+            api_url=api_url,
+            team_id=team_id,
+            season=season,
+            mode=mode,
+            batch_size=stream_batch_size,
+            queue_size=stream_queue_size,
+            load_method=load_method,
+            load_workers=load_workers,
+            checkpoint_store=checkpoint_store,
+            stats_chunk_size=stats_chunk_size,
+            stats_date_shards=stats_date_shards,
+            landing_zone=landing_zone,
+            layout=layout,
+            derive_in_db=derive_in_db,
+        )
+
+    if replay:
+        return run_replay_pipeline(
+            logger=logger,
+            sql_client=sql_client,
+            tables_template=tables_template,
+            team_id=team_id,
+            season=season,
+            mode=mode,
+            landing_zone=landing_zone,
+            load_method=load_method,
+            load_workers=load_workers,
+            layout=layout,
+            derive_in_db=derive_in_db,
+        )
+
+    from etl.assets.tranformers.transform_balldontlie import TransformBalldontlie
+
+    logger.info(f"Starting pipeline run. Team ID: {team_id}, Season: {season}, API URL: {api_url}, Mode: {mode}")
+
+    # Extracting
+    extractor = ExtractBalldontlie(
+        sql_client = sql_client,
+        mode = mode,
+        api_key=api_key,
+        api_url=api_url,
+        team_id=team_id,
+        season=season,
+        logger=logger,
+        http_client=http_client,
+        checkpoint_store=checkpoint_store,
+        stats_chunk_size=stats_chunk_size,
+        stats_date_shards=stats_date_shards,
+        start_date=start_date,
+        end_date=end_date,
+        window_days=window_days,
+        layout=layout,
+    )
+
+    team, team_players, team_games, players_stats = extractor.extract()
+
+    # Landing the raw records lets later transforms replay them without calling the API
+    if landing_zone:
+        land(logger, landing_zone, team_id, season, team=[team], players=team_players, games=team_games, stats=players_stats)
+
+    # Transforming
+    transformer = TransformBalldontlie(
+        team_data=team,
+        team_players_data=team_players,
+        team_games_data=team_games,
+        players_stats_data=players_stats,
+        logger=logger,
+        derive_in_db=derive_in_db,
+        partial_season=mode != "full",
+    )
+
+    result = transform_and_load(logger, sql_client, tables_template, transformer, team_id, season, mode, load_method, load_workers, layout, derive_in_db)
+    extractor.save_checkpoints()
+    return result
+
+def run_replay_pipeline(
+    logger: Logger,
+    sql_client: PostgreSqlClient,
+    tables_template: Environment,
+    team_id: int,
+    season: str,
+    mode: str,
+    landing_zone: LandingZone,
+    load_method: str,
+    load_workers: int,
+    layout: str = "per_team",
+    derive_in_db: bool = False,
+) -> dict:
+    if not landing_zone:
+        raise ValueError("Replaying a run requires a landing zone.")
+
+    from etl.assets.tranformers.transform_balldontlie import TransformBalldontlie
+
+    logger.info(f"Starting replay pipeline run. Team ID: {team_id}, Season: {season}, Landing zone: {landing_zone.path}, Mode: {mode}")
+    transformer = TransformBalldontlie.from_landing_zone(logger, landing_zone, team_id, season, derive_in_db=derive_in_db)
+    return transform_and_load(logger, sql_client, tables_template, transformer, team_id, season, mode, load_method, load_workers, layout, derive_in_db)
+
+def land(logger: Logger, landing_zone: LandingZone, team_id: int, season: str, **entities) -> None:
+    with get_metrics().timer("land"):
+        for entity, records in entities.items():
+            file_path = landing_zone.write(entity, team_id, season, records)
+            if file_path:
+                logger.info(f"Landed {len(records)} {entity} records. File: {file_path}")
+
+def transform_and_load(
+    logger: Logger,
+    sql_client: PostgreSqlClient,
+    tables_template: Environment,
+    transformer: TransformBalldontlie,
+    team_id: int,
+    season: str,
+    mode: str,
+    load_method: str,
+    load_workers: int,
+    layout: str = "per_team",
+    derive_in_db: bool = False,
+) -> dict:
+    from etl.assets.loader.load_balldontlie import LoadBalldontlie
+
+    team_name = transformer.team_data.get("name").lower()
+
+    df_team, df_team_players, df_team_games, df_players_performance, df_players_overall_performance = transformer.transform()
+
+    # Loading
+    loader = LoadBalldontlie(
+        tables_template=tables_template,
+        team_name=team_name,
+        season=season,
+        sql_client=sql_client,
+        logger=logger,
+        df_team=df_team,
+        df_team_players=df_team_players,
+        df_team_games=df_team_games,
+        df_players_performance=df_players_performance,
+        df_players_overall_performance=df_players_overall_performance,
+        load_method=load_method,
+        max_workers=load_workers,
+        layout=layout,
+        team_id=team_id,
+        derive_in_db=derive_in_db,
+    )
+
+    loader.load(mode=mode)
+
+    return {
+        "team_id": team_id,
+        "season": season,
+        "team_name": team_name,
+        "status": "success",
+        "rows": {
+            "players": len(df_team_players),
+            "games": len(df_team_games),
+            "players_performance": len(df_players_performance),
+            "players_overall_performance": len(df_players_overall_performance),
+        },
+        "tables": loader.load_report,
+    }
+
+def run_streaming_pipeline(
+    logger: Logger,
+    sql_client: PostgreSqlClient,
+    http_client: HttpClient,
+    tables_template: Environment,
+    api_key: str,
+    api_url: str,
+    team_id: int,
+    season: str,
+    mode: str,
+    batch_size: int,
+    queue_size: int,
+    load_method: str,
+    load_workers: int,
+    checkpoint_store: CheckpointStore = None,
+    stats_chunk_size: int = 25,
+    stats_date_shards: int = 1,
+    landing_zone: LandingZone = None,
+    layout: str = "per_team",
+    derive_in_db: bool = False,
+) -> dict:
+    from pandas import DataFrame
+    from etl.assets.tranformers.transform_balldontlie import TransformBalldontlie
+    from etl.assets.loader.load_balldontlie import LoadBalldontlie
+
+    logger.info(f"Starting streaming pipeline run. Team ID: {team_id}, Season: {season}, API URL: {api_url}, Mode: {mode}")
+
+    extractor = ExtractBalldontlie(
+        sql_client = sql_client,
+        mode = mode,
+        api_key=api_key,
+        api_url=api_url,
+        team_id=team_id,
+        season=season,
+        logger=logger,
+        http_client=http_client,
+        checkpoint_store=checkpoint_store,
+        stats_chunk_size=stats_chunk_size,
+        stats_date_shards=stats_date_shards,
+        layout=layout,
+    )
+
+    # Team, roster and schedule are small, so they go through the regular path first
+    team = extractor.extract_team()
+    extractor.team_name = team.get("name").lower()
+    team_players = extractor.extract_players()
+    team_games = extractor.extract_games()
+    if landing_zone:
+        land(logger, landing_zone, team_id, season, team=[team], players=team_players, games=team_games)
+
+    transformer = TransformBalldontlie(
+        team_data=team,
+        team_players_data=team_players,
+        team_games_data=team_games,
+        players_stats_data=RecordStore(),
+        logger=logger,
+        derive_in_db=derive_in_db,
+        partial_season=mode != "full",
+    )
+
+    loader = LoadBalldontlie(
+        tables_template=tables_template,
+        team_name=extractor.team_name,
+        season=season,
+        sql_client=sql_client,
+        logger=logger,
+        df_team=transformer.team(),
+        df_team_players=transformer.team_players(),
+        df_team_games=transformer.team_games(team['id']),
+        df_players_performance=DataFrame(),
+        df_players_overall_performance=DataFrame(),
+        load_method=load_method,
+        max_workers=load_workers,
+        layout=layout,
+        team_id=team_id,
+        derive_in_db=derive_in_db,
+    )
+    # Stats batches are written into the same (shadow) tables, which are only swapped in at the end of a full run.
+    # The partitioned layout replaces the team's rows when the first batch is written instead.
+    loader.begin(mode)
+    loader.load_tables()
+
+    # Stats pages are fetched on a producer thread while the previous batch is transformed and upserted.
+    # The bounded queue keeps at most `queue_size` batches in memory.
+    batches = Queue(maxsize=queue_size)
+    stopped = Event()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                batches.put(item, timeout=1)
+                return True
+            except Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            player_ids = team_players.ids()
+            for batch in extractor.stream_players_stats(player_ids, batch_size):
+                if not put((batch, extractor.pending_checkpoints())):
+                    return
+            put(None)
+        except Exception as e:
+            put(e)
+
+    producer = Thread(target=produce, daemon=True)
+    producer.start()
+
+    totals = DataFrame()
+    stats_rows = 0
+    try:
+        while True:
+            item = batches.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            batch, cursors = item
+            if landing_zone:
+                land(logger, landing_zone, team_id, season, stats=batch)
+
+            batch_transformer = TransformBalldontlie(
+                team_data=team,
+                team_players_data=RecordStore(),
+                team_games_data=RecordStore(),
+                players_stats_data=batch,
+                logger=logger
+            )
+            with get_metrics().timer("transform", table="players_performance"):
+                df_players_performance = batch_transformer.team_players_performance()
+                if not derive_in_db:
+                    totals = TransformBalldontlie.merge_players_totals(totals, batch_transformer.team_players_totals())
+            loader.load_players_performance_batch(df_players_performance)
+            stats_rows += len(batch)
+            # Incremental batches are committed as they go, so a crashed run resumes after the last loaded batch
+            if mode != "full":
+                extractor.save_checkpoints(cursors)
+    finally:
+        # Unblocks the producer if loading failed midway
+        stopped.set()
+        producer.join()
+
+    with get_metrics().timer("transform", table="players_overall_performance"):
+        loader.df_players_overall_performance = TransformBalldontlie.overall_performance_from_totals(totals)
+    with get_metrics().timer("load", table="players_overall_performance"):
+        loader.load_players_overall_performance("players_overall_performance")
+    loader.commit()
+    extractor.save_checkpoints()
+
+    return {
+        "team_id": team_id,
+        "season": season,
+        "team_name": extractor.team_name,
+        "status": "success",
+        "rows": {
+            "players": len(loader.df_team_players),
+            "games": len(loader.df_team_games),
+            "players_performance": stats_rows,
+            "players_overall_performance": len(loader.df_players_overall_performance),
+        },
+        "tables": loader.load_report,
     }
-    
-    return config
+
+def run_batch(logger: Logger, targets: list[tuple], max_workers: int, **pipeline_kwargs) -> list[dict]:
+    # A failing target is reported and does not stop the others
+    def run_target(target):
+        team_id, season = target
+        try:
+            with get_metrics().timer("pipeline", team_id=team_id, season=season):
+                return run_pipeline(logger=logger, team_id=team_id, season=season, **pipeline_kwargs)
+        except Exception as e:
+            logger.error(f"Pipeline run failed for Team ID: {team_id}, Season: {season}. Error: {e}")
+            return {"team_id": team_id, "season": season, "status": "failed", "error": str(e)}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(run_target, targets))
+
+    succeeded = [result for result in results if result["status"] == "success"]
+    logger.info(f"Batch run finished. Targets: {len(results)}, Succeeded: {len(succeeded)}, Failed: {len(results) - len(succeeded)}")
+    if len(succeeded) > 0:
+        refresh_league_views(logger, **pipeline_kwargs)
+    for result in results:
+        logger.info(f"Target result: {result}")
+
+    return results
+
+def refresh_league_views(logger: Logger, sql_client: PostgreSqlClient, tables_template: Environment, layout: str = "per_team", derive_in_db: bool = False, **pipeline_kwargs) -> None:
+    # Partitioned views cover the whole league, so they are refreshed once after every target is committed
+    if layout != "partitioned" or not derive_in_db:
+        return
+
+    from etl.assets.loader.load_balldontlie import LoadBalldontlie
+
+    try:
+        LoadBalldontlie.refresh_league_views(sql_client, tables_template)
+    except Exception as e:
+        logger.error(f"Refreshing the league views failed. Error: {e}")
+
+def changed_targets(logger: Logger, targets: list[tuple], max_workers: int, **extractor_kwargs) -> list[tuple]:
+    # Probes every target with one /games request, only the ones with a newly final game are run
+    def has_changed(target):
+        team_id, season = target
+        extractor = ExtractBalldontlie(sql_client=None, logger=logger, team_id=team_id, season=season, **extractor_kwargs)
+        if extractor.has_new_final_games():
+            return True
+        logger.info(f"Nothing changed since the last final game, skipped. Team ID: {team_id}, Season: {season}")
+        return False
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return [target for target, changed in zip(targets, executor.map(has_changed, targets)) if changed]
 
 if __name__ == "__main__":
     load_dotenv()
-    
-    config = get_config()
-    team_id = config.get("team_id")
-    season = config.get("season")
+
+    # SSM parameters are cached in SSM_CACHE_PATH for SSM_CACHE_TTL seconds. With SSM_PARAMETER_PATH they are
+    # read from under that path, and SSM_STUB_PATH replaces SSM with a local JSON file of name -> value.
+    SSM_CACHE_PATH = os.environ.get("SSM_CACHE_PATH")
+    SSM_CACHE_TTL = int(os.environ.get("SSM_CACHE_TTL", 900))
+    SSM_PARAMETER_PATH = os.environ.get("SSM_PARAMETER_PATH")
+    SSM_STUB_PATH = os.environ.get("SSM_STUB_PATH")
+
+    config = get_config(ConfigManager(
+        client=LocalParameterStore(path=SSM_STUB_PATH) if SSM_STUB_PATH else None,
+        cache_path=SSM_CACHE_PATH,
+        ttl_seconds=SSM_CACHE_TTL,
+        path=SSM_PARAMETER_PATH,
+    ))
+    targets = get_targets(config)
     api_url = config.get("api_url")
-    
+
     SERVER_NAME = os.environ.get("DB_SERVER_NAME")
     DATABASE_NAME = os.environ.get("DB_NAME")
     DB_USERNAME = os.environ.get("DB_USERNAME")
     DB_PASSWORD = os.environ.get("DB_PASSWORD")
     PORT = os.environ.get("DB_PORT")
     MODE = os.environ.get("MODE", "increment")
-    
+    MAX_WORKERS = int(os.environ.get("MAX_WORKERS", 4))
+    STREAMING = os.environ.get("STREAMING", "false").lower() == "true"
+    STREAM_BATCH_SIZE = int(os.environ.get("STREAM_BATCH_SIZE", 1000))
+    LOAD_METHOD = os.environ.get("LOAD_METHOD", "copy")
+    LOAD_WORKERS = int(os.environ.get("LOAD_WORKERS", 5))
+    REQUESTS_PER_MINUTE = int(os.environ.get("REQUESTS_PER_MINUTE", 60))
+    HTTP_CACHE_PATH = os.environ.get("HTTP_CACHE_PATH")
+    HTTP_CACHE_MAX_MB = int(os.environ.get("HTTP_CACHE_MAX_MB", 512))
+    CHECKPOINT_PATH = os.environ.get("CHECKPOINT_PATH")
+    STATS_CHUNK_SIZE = int(os.environ.get("STATS_CHUNK_SIZE", 25))
+    STATS_DATE_SHARDS = int(os.environ.get("STATS_DATE_SHARDS", 1))
+    # MODE=window: only games between these dates (default: since the last final game) and their box scores
+    WINDOW_START_DATE = os.environ.get("WINDOW_START_DATE")
+    WINDOW_END_DATE = os.environ.get("WINDOW_END_DATE")
+    WINDOW_DAYS = int(os.environ.get("WINDOW_DAYS", 3))
+    # Raw records are landed as Parquet when set, REPLAY=true transforms and loads them without calling the API
+    LANDING_ZONE_PATH = os.environ.get("LANDING_ZONE_PATH")
+    REPLAY = os.environ.get("REPLAY", "false").lower() == "true"
+    # STORAGE_LAYOUT=partitioned: one table per entity for all teams, partitioned by season
+    STORAGE_LAYOUT = os.environ.get("STORAGE_LAYOUT", "per_team")
+    # DERIVE_IN_DB=true: overall performance and cumulative wins/losses are materialized views refreshed after each load
+    DERIVE_IN_DB = os.environ.get("DERIVE_IN_DB", "false").lower() == "true"
+    # Increment and window runs with checkpoints skip the targets without a newly final game
+    SKIP_UNCHANGED = os.environ.get("SKIP_UNCHANGED", "true").lower() == "true"
+    METRICS_PATH = os.environ.get("METRICS_PATH")
+    METRICS_PROMETHEUS_PATH = os.environ.get("METRICS_PROMETHEUS_PATH")
+
     BALL_DONT_LIE_API_KEY = os.environ.get("BALL_DONT_LIE_API_KEY")
-    
-    tables_template = Environment(
-        loader=FileSystemLoader("etl/assets/sql")
-    )
 
-    if not team_id:
-        raise ValueError("Invalid or missing 'team_id' in configuration.")
-    
-    if not season:
-        raise ValueError("Invalid or missing 'season' in configuration.")
-    
+    for team_id, season in targets:
+        if not team_id:
+            raise ValueError("Invalid or missing 'team_id' in configuration.")
+
+        if not season:
+            raise ValueError("Invalid or missing 'season' in configuration.")
+
     if not api_url:
         raise ValueError("Invalid or missing 'api_url' in configuration.")
-    
-    if not BALL_DONT_LIE_API_KEY:
+
+    if not BALL_DONT_LIE_API_KEY and not REPLAY:
         raise ValueError("Invalid or missing 'BALL_DONT_LIE_API_KEY' in environment variables.")
-    
+
     if not SERVER_NAME or not DATABASE_NAME or not DB_USERNAME or not DB_PASSWORD:
         raise ValueError("Invalid or missing database configuration in environment variables.")
 
-    if not tables_template:
-        raise ValueError("Invalid or missing 'tables_template' in configuration.")
-    
+    if STORAGE_LAYOUT not in ("per_team", "partitioned"):
+        raise ValueError("Invalid 'STORAGE_LAYOUT' in environment variables, expected 'per_team' or 'partitioned'.")
+
     logger = get_logger(
         name='nba_pipeline_log', log_group='nba_pipeline_log_group', stream_name='nba_pipeline_log_stream'
     )
-    
+
+    # Sized for every batch worker paging several cursor chains at once
+    http_client = HttpClient(
+        pool_size=MAX_WORKERS * 4,
+        rate_limiter=RateLimiter(requests_per_minute=REQUESTS_PER_MINUTE),
+        cache=HttpCache(HTTP_CACHE_PATH, max_bytes=HTTP_CACHE_MAX_MB * 1024 * 1024) if HTTP_CACHE_PATH else None,
+    )
+    checkpoint_store = CheckpointStore(CHECKPOINT_PATH) if CHECKPOINT_PATH else None
+
+    if SKIP_UNCHANGED and MODE in ("increment", "window") and checkpoint_store and not REPLAY and not WINDOW_START_DATE:
+        targets = changed_targets(
+            logger=logger,
+            targets=targets,
+            max_workers=MAX_WORKERS,
+            api_key=BALL_DONT_LIE_API_KEY,
+            api_url=api_url,
+            mode=MODE,
+            http_client=http_client,
+            checkpoint_store=checkpoint_store,
+            end_date=WINDOW_END_DATE,
+        )
+        if len(targets) == 0:
+            logger.info("Nothing changed for any target, exiting before loading.")
+            sys.exit(0)
+
+    from jinja2 import Environment, FileSystemLoader
+    from etl.connectors.postgresql import PostgreSqlClient
+
+    tables_template = Environment(
+        loader=FileSystemLoader("etl/assets/sql")
+    )
+
     sql_client = PostgreSqlClient(
         logger=logger,
         server_name=SERVER_NAME,
@@ -80,54 +573,51 @@ if __name__ == "__main__":
         username=DB_USERNAME,
         password=DB_PASSWORD,
         port=PORT,
+        pool_size=MAX_WORKERS * LOAD_WORKERS,
     )
-    
-    logger.info(f"Starting pipeline run. Team ID: {team_id}, Season: {season}, API URL: {api_url}, Mode: {MODE}") 
 
-    try:
-        # Extracting
-        extractor = ExtractBalldontlie(
-            sql_client = sql_client,
-            mode = MODE,
-            api_key=BALL_DONT_LIE_API_KEY, 
-            api_url=api_url, 
-            team_id=team_id, 
-            season=season,
-            logger=logger
-        )
-        
-        team, team_players, team_games, players_stats = extractor.extract()
-        team_name = team.get("name").lower()
-
-        # Transforming
-        transformer = TransformBalldontlie(
-            team_data=team, 
-            team_players_data=team_players, 
-            team_games_data=team_games, 
-            players_stats_data=players_stats,
-            logger=logger
-        )
-       
-        df_team, df_team_players, df_team_games, df_players_performance, df_players_overall_performance = transformer.transform()
-
-        # Loading        
-        loader = LoadBalldontlie(
-            tables_template=tables_template, 
-            team_name=team_name, 
-            season=season, 
-            sql_client=sql_client,
-            logger=logger,
-            df_team=df_team,
-            df_team_players=df_team_players,
-            df_team_games=df_team_games,
-            df_players_performance=df_players_performance,
-            df_players_overall_performance=df_players_overall_performance,
-        )
-        
-        loader.load(mode=MODE)
-        
-        logger.info("Pipeline run successfully.")
-    except Exception as e:
-        logger.error(f"Pipeline run failed. See detailed logs: {e}")
-       
+    pipeline_kwargs = {
+        "sql_client": sql_client,
+        "http_client": http_client,
+        "tables_template": tables_template,
+        "api_key": BALL_DONT_LIE_API_KEY,
+        "api_url": api_url,
+        "mode": MODE,
+        "streaming": STREAMING,
+        "stream_batch_size": STREAM_BATCH_SIZE,
+        "load_method": LOAD_METHOD,
+        "load_workers": LOAD_WORKERS,
+        "checkpoint_store": checkpoint_store,
+        "stats_chunk_size": STATS_CHUNK_SIZE,
+        "stats_date_shards": STATS_DATE_SHARDS,
+        "start_date": WINDOW_START_DATE,
+        "end_date": WINDOW_END_DATE,
+        "window_days": WINDOW_DAYS,
+        "landing_zone": LandingZone(LANDING_ZONE_PATH) if LANDING_ZONE_PATH else None,
+        "replay": REPLAY,
+        "layout": STORAGE_LAYOUT,
+        "derive_in_db": DERIVE_IN_DB,
+    }
+
+    if len(targets) > 1:
+        run_batch(logger=logger, targets=targets, max_workers=MAX_WORKERS, **pipeline_kwargs)
+    else:
+        team_id, season = targets[0]
+        try:
+            with get_metrics().timer("pipeline", team_id=team_id, season=season):
+                run_pipeline(logger=logger, team_id=team_id, season=season, **pipeline_kwargs)
+            refresh_league_views(logger, **pipeline_kwargs)
+            logger.info("Pipeline run successfully.")
+        except Exception as e:
+            logger.error(f"Pipeline run failed. See detailed logs: {e}")
+
+    logger.info(f"Catalog queries saved by the table metadata cache: {sql_client.catalog_queries_saved}")
 
+    # Run report: wall/CPU time per stage and table, HTTP latencies, 429 backoff, upsert throughput and peak RSS
+    metrics = get_metrics()
+    report = metrics.report()
+    logger.info(f"Run finished. Wall time: {report['wall_seconds']:.1f}s, CPU time: {report['cpu_seconds']:.1f}s, Peak RSS: {report['peak_rss_bytes']} bytes")
+    if METRICS_PATH:
+        Path(METRICS_PATH).write_text(metrics.to_json())
+    if METRICS_PROMETHEUS_PATH:
+        Path(METRICS_PROMETHEUS_PATH).write_text(metrics.to_prometheus())
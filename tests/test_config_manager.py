@@ -0,0 +1,61 @@
+import time
+from botocore.exceptions import ClientError
+from etl.connectors.config_manager import ConfigManager, LocalParameterStore
+
+PARAMETERS = {"/etl/db_host": "localhost", "/etl/db_port": "5432", "/etl/api_key": "secret"}
+
+class FailingParameterStore(LocalParameterStore):
+    # Fails the first `failures` calls the way SSM does when throttled
+    def __init__(self, parameters: dict = None, failures: int = 1):
+        super().__init__(parameters)
+        self.failures = failures
+
+    def get_parameters(self, Names, WithDecryption=False):
+        if self.failures > 0:
+            self.failures -= 1
+            self.calls += 1
+            raise ClientError({"Error": {"Code": "ThrottlingException", "Message": "Rate exceeded"}}, "GetParameters")
+        return super().get_parameters(Names, WithDecryption)
+
+def make_manager(client, tmp_path, **kwargs):
+    return ConfigManager(client=client, cache_path=str(tmp_path / "parameters.json"), **kwargs)
+
+def test_one_call_for_several_names(tmp_path):
+    client = LocalParameterStore(PARAMETERS)
+    manager = make_manager(client, tmp_path)
+
+    values = manager.get_parameters(["/etl/db_host", "/etl/db_port", "/etl/api_key", "/etl/missing"])
+
+    assert values == {"/etl/db_host": "localhost", "/etl/db_port": "5432", "/etl/api_key": "secret", "/etl/missing": None}
+    assert client.calls == 1
+
+def test_cache_file_is_used_until_the_ttl(tmp_path, monkeypatch):
+    make_manager(LocalParameterStore(PARAMETERS), tmp_path, ttl_seconds=60).get_parameters(["/etl/db_host", "/etl/db_port"])
+
+    # A later run within the TTL reads the file instead of asking SSM
+    client = LocalParameterStore(PARAMETERS)
+    assert make_manager(client, tmp_path, ttl_seconds=60).get_parameters(["/etl/db_host", "/etl/db_port"]) == {"/etl/db_host": "localhost", "/etl/db_port": "5432"}
+    assert client.calls == 0
+
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 61)
+    client = LocalParameterStore(dict(PARAMETERS, **{"/etl/db_host": "db.internal"}))
+    assert make_manager(client, tmp_path, ttl_seconds=60).get_parameter("/etl/db_host") == "db.internal"
+    assert client.calls == 1
+
+def test_failed_call_is_not_cached(tmp_path):
+    client = FailingParameterStore(PARAMETERS)
+    manager = make_manager(client, tmp_path)
+
+    assert manager.get_parameter("/etl/db_host") is None
+    assert not (tmp_path / "parameters.json").exists()
+
+    assert manager.get_parameter("/etl/db_host") == "localhost"
+    assert client.calls == 2
+
+def test_path_mode_strips_the_prefix(tmp_path):
+    client = LocalParameterStore(dict(PARAMETERS, **{"/other/db_host": "elsewhere"}))
+    manager = make_manager(client, tmp_path, path="/etl/")
+
+    assert manager.get_parameters(["db_host", "db_port", "api_key"]) == {"db_host": "localhost", "db_port": "5432", "api_key": "secret"}
+    assert client.calls == 1
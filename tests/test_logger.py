@@ -0,0 +1,71 @@
+import logging
+import threading
+from etl.connectors.logger import EVENT_OVERHEAD_BYTES, CloudWatchHandler
+
+class StubLogsClient:
+    # Records every put_log_events call instead of sending it to CloudWatch
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.batches = []
+
+    def put_log_events(self, **kwargs):
+        with self.lock:
+            self.batches.append(kwargs["logEvents"])
+            return {"nextSequenceToken": str(len(self.batches))}
+
+def make_handler(client, **kwargs):
+    # A long flush interval keeps the flusher thread from sending before the test does
+    handler = CloudWatchHandler("group", "stream", client=client, flush_interval=60, **kwargs)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    return handler
+
+def emit(handler, message, created=None):
+    record = logging.LogRecord("test", logging.INFO, __file__, 0, message, None, None)
+    if created is not None:
+        record.created = created
+    handler.emit(record)
+
+def sent_messages(client):
+    return [log_event["message"] for batch in client.batches for log_event in batch]
+
+def test_batches_by_count_and_bytes():
+    client = StubLogsClient()
+    handler = make_handler(client, max_batch_count=3)
+    for i in range(7):
+        emit(handler, f"message {i}")
+    handler.close()
+
+    assert sent_messages(client) == [f"message {i}" for i in range(7)]
+    assert all(len(batch) <= 3 for batch in client.batches)
+
+    client = StubLogsClient()
+    message_bytes = len("x" * 100) + EVENT_OVERHEAD_BYTES
+    handler = make_handler(client, max_batch_bytes=2 * message_bytes)
+    for _ in range(5):
+        emit(handler, "x" * 100)
+    handler.close()
+
+    assert len(sent_messages(client)) == 5
+    assert all(sum(len(log_event["message"]) + EVENT_OVERHEAD_BYTES for log_event in batch) <= 2 * message_bytes for batch in client.batches)
+
+def test_events_are_sent_in_timestamp_order():
+    client = StubLogsClient()
+    handler = make_handler(client)
+    for created in (1000.003, 1000.001, 1000.002):
+        emit(handler, str(created), created=created)
+    handler.close()
+
+    timestamps = [log_event["timestamp"] for batch in client.batches for log_event in batch]
+    assert timestamps == [1000001, 1000002, 1000003]
+
+def test_close_drains_the_buffer():
+    client = StubLogsClient()
+    handler = make_handler(client)
+    for i in range(10):
+        emit(handler, f"message {i}")
+    assert client.batches == []
+
+    handler.close()
+
+    assert sent_messages(client) == [f"message {i}" for i in range(10)]
+    assert not handler.flusher.is_alive()